@@ -0,0 +1,112 @@
+import hashlib
+import itertools
+import os
+import random
+from typing import Any, Dict
+
+from aiohttp import web
+
+
+class FakeDrive:
+    """Stand-in local da API do Drive v3: listagem da pasta e upload resumable (POST/PATCH + PUT).
+
+    Guarda os arquivos em memória e conta chamadas e bytes recebidos. `error_rate` devolve 503 em
+    parte dos PUTs, para exercitar a retomada do upload.
+    """
+
+    def __init__(self, error_rate: float = 0.0, seed: int = 42) -> None:
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.reset()
+
+    def reset(self) -> None:
+        self.files.clear()
+        self._sessions.clear()
+        self.created = 0
+        self.updated = 0
+        self.chunks = 0
+        self.errors = 0
+        self.bytes_in = 0
+
+    def counters(self) -> Dict[str, int]:
+        return {
+            "created": self.created,
+            "updated": self.updated,
+            "chunks": self.chunks,
+            "errors": self.errors,
+            "bytes_in": self.bytes_in,
+        }
+
+    async def list_files(self, request: web.Request) -> web.Response:
+        files = [
+            {"id": f["id"], "name": f["name"], "md5Checksum": hashlib.md5(f["content"]).hexdigest()}
+            for f in self.files.values()
+        ]
+        return web.json_response({"files": files})
+
+    async def start_upload(self, request: web.Request) -> web.Response:
+        file_id = request.match_info.get("file_id")
+        if file_id:
+            self.updated += 1
+        else:
+            self.created += 1
+        meta = await request.json() if request.can_read_body else {}
+        session_id = str(len(self._sessions) + 1)
+        self._sessions[session_id] = {"file_id": file_id, "meta": meta, "buf": bytearray()}
+        return web.Response(headers={"Location": str(request.url.with_query({"upload_id": session_id}))})
+
+    async def put_chunk(self, request: web.Request) -> web.Response:
+        self.chunks += 1
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=503)
+        session = self._sessions[request.query["upload_id"]]
+        data = await request.read()
+        self.bytes_in += len(data)
+        buf = session["buf"]
+        content_range = request.headers.get("Content-Range", "")
+        total = content_range.rsplit("/", 1)[-1] if "/" in content_range else ""
+        if content_range.startswith("bytes */"):
+            # Consulta de status da sessão (retomada após erro): não traz dados
+            pass
+        else:
+            start = int(content_range.split()[1].split("-")[0]) if content_range.startswith("bytes ") else 0
+            del buf[start:]
+            buf += data
+        if total == "*" or (total and len(buf) < int(total)):
+            headers = {"Range": f"bytes=0-{len(buf) - 1}"} if buf else {}
+            return web.Response(status=308, headers=headers)
+        file_id = session["file_id"] or f"bench{next(self._ids)}"
+        name = session["meta"].get("name") or self.files[file_id]["name"]
+        self.files[file_id] = {"id": file_id, "name": name, "content": bytes(buf)}
+        return web.json_response({"id": file_id})
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_get("/drive/v3/files", self.list_files)
+        app.router.add_post("/upload/drive/v3/files", self.start_upload)
+        app.router.add_patch("/upload/drive/v3/files/{file_id}", self.start_upload)
+        app.router.add_put("/upload/drive/v3/files", self.put_chunk)
+        app.router.add_put("/upload/drive/v3/files/{file_id}", self.put_chunk)
+        return app
+
+
+def point_drive_client_at(drive_client: Any, root_url: str) -> None:
+    """Faz o DriveUploader falar com `root_url` (um FakeDrive), sem credenciais do Google.
+
+    Usa o documento de discovery do Drive v3 que acompanha o google-api-python-client, trocando
+    só a URL raiz.
+    """
+    import googleapiclient
+    from google.oauth2.credentials import Credentials
+    from googleapiclient.discovery import build_from_document
+
+    path = os.path.join(os.path.dirname(googleapiclient.__file__), "discovery_cache", "documents", "drive.v3.json")
+    with open(path, "r", encoding="utf-8") as f:
+        document = f.read().replace("https://www.googleapis.com/", root_url.rstrip("/") + "/")
+
+    drive_client.build = lambda *args, **kwargs: build_from_document(document, credentials=kwargs.get("credentials"))
+    drive_client.load_google_credentials = lambda **kwargs: Credentials(token="bench")
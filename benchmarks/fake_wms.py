@@ -0,0 +1,144 @@
+import asyncio
+import json
+import math
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+# Horário local do WMS, como nos timestamps reais da LgfAPI
+_BASE_TS = datetime(2024, 1, 1, tzinfo=timezone(timedelta(hours=-3)))
+_ORDER_TYPES = ("90", "90", "90", "91")
+
+
+class WMSProfile:
+    """Parâmetros do servidor falso: volume por entidade, paginação, latência e taxa de erros."""
+
+    def __init__(
+        self,
+        rows: Optional[Dict[str, int]] = None,
+        page_size: int = 1000,
+        latency_ms: float = 20.0,
+        jitter_ms: float = 5.0,
+        throttle_rate: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = 42,
+    ) -> None:
+        self.rows = {"order_hdr": 10000, "order_dtl": 30000, "order_status": 20}
+        self.rows.update(rows or {})
+        self.page_size = page_size
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.seed = seed
+
+
+def _record(entity: str, i: int, hdr_rows: int) -> Dict[str, Any]:
+    ts = (_BASE_TS + timedelta(seconds=37 * i)).isoformat()
+    rec: Dict[str, Any] = {"id": i + 1, "create_ts": ts, "mod_ts": ts, "create_user": "bench", "mod_user": "bench"}
+    if entity == "order_hdr":
+        rec.update(
+            order_nbr=f"PED{i + 1:08d}",
+            facility_id={"id": 1, "key": "CD01"},
+            company_id={"id": 1, "key": "ARCO"},
+            order_type_id={"id": 2, "key": _ORDER_TYPES[i % len(_ORDER_TYPES)]},
+            status_id=(i % 9) * 10,
+            ord_date=ts[:10],
+            cust_name=f"Cliente {i % 500}",
+            cust_city="São Paulo",
+            cust_field_2=f"NF{i + 1:09d}" if i % 3 else "",
+            priority=i % 5,
+            order_shipped_ts=ts if i % 4 == 0 else None,
+        )
+    elif entity == "order_dtl":
+        order = i % max(1, hdr_rows) + 1
+        rec.update(
+            order_id={"id": order, "key": f"PED{order:08d}"},
+            item_id={"id": i % 2000, "key": f"SKU{i % 2000:05d}"},
+            ord_qty=float(i % 40 + 1),
+            orig_ord_qty=float(i % 40 + 1),
+            alloc_qty=float(i % 20),
+            status_id=(i % 9) * 10,
+            invn_attr_id={"id": 1, "key": "LOTE", "url": "https://wms/invn_attr/1"},
+        )
+    elif entity == "order_status":
+        rec.update(id=i * 10, description=f"Status {i * 10}")
+    else:
+        raise web.HTTPNotFound()
+    return rec
+
+
+class FakeWMS:
+    """Stand-in local de /wms/lgfapi/v10/entity/{entity} com dados sintéticos determinísticos.
+
+    Respeita `page`, `page_size` e `fields` como a LgfAPI. Os corpos de cada página são gerados
+    uma vez e reaproveitados, para que o servidor não vire o gargalo do benchmark. Os contadores
+    (`requests`, `pages`, `rows`, `throttled`, `errors`) são zerados por `reset()`.
+    """
+
+    def __init__(self, profile: WMSProfile) -> None:
+        self.profile = profile
+        self._random = random.Random(profile.seed)
+        self._bodies: Dict[str, bytes] = {}
+        self.reset()
+
+    def reset(self) -> None:
+        self.requests = 0
+        self.pages = 0
+        self.rows = 0
+        self.throttled = 0
+        self.errors = 0
+
+    def counters(self) -> Dict[str, int]:
+        return {
+            "requests": self.requests,
+            "pages": self.pages,
+            "rows": self.rows,
+            "throttled": self.throttled,
+            "errors": self.errors,
+        }
+
+    def _page(self, entity: str, page: int, page_size: int, fields: Optional[List[str]]) -> Dict[str, Any]:
+        total = self.profile.rows.get(entity, 0)
+        page_count = max(1, math.ceil(total / page_size))
+        start = (page - 1) * page_size
+        hdr_rows = self.profile.rows.get("order_hdr", 1)
+        results = [_record(entity, i, hdr_rows) for i in range(start, min(start + page_size, total))]
+        if fields:
+            results = [{k: v for k, v in rec.items() if k in fields} for rec in results]
+        return {"result_count": total, "page_count": page_count, "page_nbr": page, "results": results}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        profile = self.profile
+        delay = profile.latency_ms + self._random.uniform(-profile.jitter_ms, profile.jitter_ms)
+        await asyncio.sleep(max(0.0, delay) / 1000.0)
+        roll = self._random.random()
+        if roll < profile.throttle_rate:
+            self.throttled += 1
+            return web.Response(status=429, headers={"Retry-After": "0"})
+        if roll < profile.throttle_rate + profile.error_rate:
+            self.errors += 1
+            return web.Response(status=503)
+
+        entity = request.match_info["entity"]
+        page = int(request.query.get("page", 1))
+        page_size = int(request.query.get("page_size", profile.page_size))
+        fields = request.query.get("fields")
+        cache_key = f"{entity}|{page}|{page_size}|{fields}"
+        body = self._bodies.get(cache_key)
+        if body is None:
+            data = self._page(entity, page, page_size, fields.split(",") if fields else None)
+            body = json.dumps(data).encode("utf-8")
+            self._bodies[cache_key] = body
+        self.pages += 1
+        total = profile.rows.get(entity, 0)
+        self.rows += max(0, min(page_size, total - (page - 1) * page_size))
+        return web.Response(body=body, content_type="application/json")
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/wms/lgfapi/v10/entity/{entity}", self.handle)
+        return app
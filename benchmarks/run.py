@@ -0,0 +1,361 @@
+"""Benchmarks de ponta a ponta contra stand-ins locais da LgfAPI do WMS e do Google Drive.
+
+Cada cenário sobe um FakeWMS e um FakeDrive neste processo e executa `main.run` (e, com
+--main-db, `main_db.main`) num subprocesso, apontado para eles via ARCO_CONFIG. São medidos
+tempo de parede, pico de RSS do subprocesso, páginas/s e linhas/s. Os resultados vão para
+benchmarks/results/<data>-<commit>.json e podem ser comparados com uma execução anterior:
+
+    python -m benchmarks.run
+    python -m benchmarks.run --scenario throttled --rows-dtl 200000 --repeat 3
+    python -m benchmarks.run --compare latest
+"""
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+from benchmarks.fake_drive import FakeDrive, point_drive_client_at
+from benchmarks.fake_wms import FakeWMS, WMSProfile
+
+try:
+    import resource
+except Exception:
+    resource = None
+
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_RESULTS_DIR = os.path.join(_REPO_DIR, "benchmarks", "results")
+
+# cenário -> (parâmetros do FakeWMS, taxa de 503 nos uploads do FakeDrive)
+SCENARIOS: Dict[str, Tuple[Dict[str, Any], float]] = {
+    "baseline": ({}, 0.0),
+    "small_pages": ({"page_size": 200}, 0.0),
+    "high_latency": ({"latency_ms": 150.0, "jitter_ms": 50.0}, 0.0),
+    "throttled": ({"throttle_rate": 0.05}, 0.0),
+    "flaky": ({"error_rate": 0.02}, 0.05),
+}
+
+# Métricas exibidas na comparação: (chave, maior é melhor)
+_COMPARED = (("wall_s", False), ("pages_per_s", True), ("rows_per_s", True), ("peak_rss_mb", False))
+
+
+# --------------------------------------------------------------------------
+# Subprocesso medido
+# --------------------------------------------------------------------------
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa em KiB; macOS em bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _worker(target: str, drive_url: str) -> None:
+    import drive_client
+
+    point_drive_client_at(drive_client, drive_url)
+    started = time.perf_counter()
+    if target == "main":
+        import main
+
+        main.run()
+    else:
+        import main_db
+
+        main_db.main()
+    wall = time.perf_counter() - started
+    print(json.dumps({"wall_s": wall, "peak_rss_mb": _peak_rss_mb()}))
+
+
+# --------------------------------------------------------------------------
+# Servidores falsos e configuração
+# --------------------------------------------------------------------------
+
+class _Servers:
+    """FakeWMS e FakeDrive rodando num loop de eventos próprio, em uma thread daemon."""
+
+    def __init__(self, wms: FakeWMS, drive: FakeDrive) -> None:
+        self.wms = wms
+        self.drive = drive
+        self.loop = asyncio.new_event_loop()
+        self._runners: List[web.AppRunner] = []
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.wms_url = self._start(wms.make_app())
+        self.drive_url = self._start(drive.make_app())
+
+    def _start(self, app: web.Application) -> str:
+        async def start() -> str:
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            self._runners.append(runner)
+            port = site._server.sockets[0].getsockname()[1]
+            return f"http://127.0.0.1:{port}"
+
+        return asyncio.run_coroutine_threadsafe(start(), self.loop).result()
+
+    def close(self) -> None:
+        async def stop() -> None:
+            for runner in self._runners:
+                await runner.cleanup()
+
+        asyncio.run_coroutine_threadsafe(stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+def _bench_config(args: argparse.Namespace, servers: _Servers, profile: WMSProfile, work_dir: str) -> Dict[str, Any]:
+    cfg: Dict[str, Any] = {
+        "wms": {
+            "base_url": servers.wms_url,
+            "username": "bench",
+            "password": "bench",
+            "default_concurrency": args.concurrency,
+            "default_page_size": profile.page_size,
+        },
+        "drive": {
+            "client_secret_file": "bench_client_secret.json",
+            "folder_id": "bench-folder",
+            "upload_backoff_base": 0.1,
+        },
+        "outputs": {},
+        # Relatório de cada execução (etapas, status) fica no diretório temporário do cenário
+        "metrics": {"report_dir": os.path.join(work_dir, "reports")},
+    }
+    if args.main_db:
+        queries = []
+        for n in range(args.db_queries):
+            sql_file = os.path.join(work_dir, f"bench_{n + 1}.sql")
+            with open(sql_file, "w", encoding="utf-8") as f:
+                f.write(_synthetic_sql(args.db_rows))
+            queries.append({"sql_file": sql_file, "output_csv": f"bench_{n + 1}.csv"})
+        cfg["database"] = {
+            "queries": queries,
+            "export_mode": args.db_export_mode,
+            "parallelism": args.db_queries,
+        }
+    return cfg
+
+
+def _synthetic_sql(rows: int) -> str:
+    return (
+        "SELECT g AS id, 'PED' || lpad(g::text, 8, '0') AS order_nbr, "
+        "timestamp '2024-01-01' + g * interval '37 seconds' AS mod_ts, (g % 40 + 1)::numeric AS ord_qty, "
+        "md5(g::text) AS payload\n"
+        f"FROM generate_series(1, {int(rows)}) AS g\n"
+    )
+
+
+# --------------------------------------------------------------------------
+# Execução dos cenários
+# --------------------------------------------------------------------------
+
+def _run_target(target: str, config_path: str, drive_url: str, verbose: bool) -> Dict[str, Any]:
+    env = dict(os.environ, ARCO_CONFIG=config_path)
+    cmd = [sys.executable, "-m", "benchmarks.run", "--worker", target, "--drive-url", drive_url]
+    proc = subprocess.run(cmd, cwd=_REPO_DIR, env=env, capture_output=True, text=True)
+    if verbose or proc.returncode != 0:
+        sys.stderr.write(proc.stderr)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{target} falhou no benchmark (código {proc.returncode})")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def _run_report(work_dir: str, target: str) -> Dict[str, Any]:
+    """Relatório (metrics.RunMetrics) mais recente gravado pela execução medida."""
+    paths = sorted(glob.glob(os.path.join(work_dir, "reports", f"{target}_[0-9]*.json")))
+    if not paths:
+        return {}
+    with open(paths[-1], "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _profile(args: argparse.Namespace, overrides: Dict[str, Any]) -> WMSProfile:
+    params: Dict[str, Any] = {"page_size": args.page_size, "latency_ms": args.latency_ms}
+    params.update(overrides)
+    if args.throttle_rate is not None:
+        params["throttle_rate"] = args.throttle_rate
+    if args.error_rate is not None:
+        params["error_rate"] = args.error_rate
+    rows = {"order_hdr": args.rows_hdr, "order_dtl": args.rows_dtl}
+    return WMSProfile(rows=rows, **params)
+
+
+def run_scenario(name: str, args: argparse.Namespace) -> List[Dict[str, Any]]:
+    overrides, drive_error_rate = SCENARIOS[name]
+    profile = _profile(args, overrides)
+    servers = _Servers(FakeWMS(profile), FakeDrive(error_rate=drive_error_rate))
+    targets = ["main"] + (["main_db"] if args.main_db else [])
+    results: List[Dict[str, Any]] = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="arco_bench_") as work_dir:
+            config_path = os.path.join(work_dir, "config.json")
+            with open(config_path, "w", encoding="utf-8") as f:
+                json.dump(_bench_config(args, servers, profile, work_dir), f, indent=2)
+
+            for target in targets:
+                for attempt in range(1, args.repeat + 1):
+                    servers.wms.reset()
+                    servers.drive.reset()
+                    measured = _run_target(target, config_path, servers.drive_url, args.verbose)
+                    report = _run_report(work_dir, target)
+                    wms = servers.wms.counters()
+                    wall = measured["wall_s"]
+                    rows = wms["rows"] if target == "main" else args.db_rows * args.db_queries
+                    result = {
+                        "scenario": name,
+                        "target": target,
+                        "attempt": attempt,
+                        "wall_s": round(wall, 3),
+                        "peak_rss_mb": measured["peak_rss_mb"] and round(measured["peak_rss_mb"], 1),
+                        "pages": wms["pages"],
+                        "rows": rows,
+                        "pages_per_s": round(wms["pages"] / wall, 1) if wall else None,
+                        "rows_per_s": round(rows / wall, 1) if wall else None,
+                        "status": report.get("status"),
+                        "stages_s": report.get("stages_seconds", {}),
+                        "wms": wms,
+                        "drive": servers.drive.counters(),
+                        "profile": vars(profile),
+                    }
+                    logging.info(
+                        "%-12s %-7s #%s  %.2fs  %s páginas  %s linhas  %.0f linhas/s  pico %s MB",
+                        name,
+                        target,
+                        attempt,
+                        wall,
+                        result["pages"],
+                        rows,
+                        result["rows_per_s"] or 0,
+                        result["peak_rss_mb"],
+                    )
+                    results.append(result)
+    finally:
+        servers.close()
+    return results
+
+
+# --------------------------------------------------------------------------
+# Resultados
+# --------------------------------------------------------------------------
+
+def _git(*args: str) -> str:
+    try:
+        return subprocess.run(["git", *args], cwd=_REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return ""
+
+
+def save_results(results: List[Dict[str, Any]], out_dir: str) -> str:
+    commit = _git("rev-parse", "--short", "HEAD") or "unknown"
+    created = datetime.now()
+    report = {
+        "commit": commit,
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "created_at": created.isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"{created.strftime('%Y%m%dT%H%M%S')}-{commit}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def _medians(results: List[Dict[str, Any]]) -> Dict[Tuple[str, str], Dict[str, float]]:
+    grouped: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    for result in results:
+        grouped.setdefault((result["scenario"], result["target"]), []).append(result)
+    return {
+        key: {
+            metric: statistics.median(r[metric] for r in runs if r.get(metric) is not None)
+            for metric, _ in _COMPARED
+            if any(r.get(metric) is not None for r in runs)
+        }
+        for key, runs in grouped.items()
+    }
+
+
+def compare(results: List[Dict[str, Any]], previous_path: str) -> None:
+    """Imprime a variação das medianas em relação a um arquivo de resultados anterior."""
+    with open(previous_path, "r", encoding="utf-8") as f:
+        previous = json.load(f)
+    before = _medians(previous["results"])
+    after = _medians(results)
+    print(f"\nComparação com {os.path.basename(previous_path)} (commit {previous.get('commit')}):")
+    for key in sorted(after):
+        if key not in before:
+            continue
+        parts = []
+        for metric, higher_is_better in _COMPARED:
+            old, new = before[key].get(metric), after[key].get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            better = change > 0 if higher_is_better else change < 0
+            parts.append(f"{metric} {old:g} -> {new:g} ({change:+.1f}%{'' if abs(change) < 5 else ' ✓' if better else ' ✗'})")
+        print(f"  {key[0]}/{key[1]}: " + "; ".join(parts))
+
+
+def _latest_results(out_dir: str, exclude: str) -> Optional[str]:
+    paths = sorted(p for p in glob.glob(os.path.join(out_dir, "*.json")) if os.path.abspath(p) != os.path.abspath(exclude))
+    return paths[-1] if paths else None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks da extração WMS -> DuckDB -> Drive com servidores locais")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="Cenário (repetível; padrão: todos)")
+    parser.add_argument("--rows-hdr", type=int, default=10000, help="Linhas sintéticas de order_hdr")
+    parser.add_argument("--rows-dtl", type=int, default=30000, help="Linhas sintéticas de order_dtl")
+    parser.add_argument("--page-size", type=int, default=1000, help="page_size servido pelo WMS falso")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Latência por requisição do WMS falso")
+    parser.add_argument("--throttle-rate", type=float, help="Fração de respostas 429 (sobrepõe o cenário)")
+    parser.add_argument("--error-rate", type=float, help="Fração de respostas 503 (sobrepõe o cenário)")
+    parser.add_argument("--concurrency", type=int, default=10, help="wms.default_concurrency usado no main.run")
+    parser.add_argument("--repeat", type=int, default=1, help="Execuções por cenário (a comparação usa a mediana)")
+    parser.add_argument("--main-db", action="store_true", help="Inclui main_db.main (Postgres via database.* / PG*)")
+    parser.add_argument("--db-rows", type=int, default=200000, help="Linhas por query sintética do main_db")
+    parser.add_argument("--db-queries", type=int, default=2, help="Quantidade de queries sintéticas do main_db")
+    parser.add_argument("--db-export-mode", default="copy", help="database.export_mode usado no main_db")
+    parser.add_argument("--out", default=_RESULTS_DIR, help="Diretório dos resultados")
+    parser.add_argument("--compare", metavar="ARQUIVO", help="Resultados anteriores para comparar ('latest' = o mais recente)")
+    parser.add_argument("--verbose", action="store_true", help="Mostra o log dos subprocessos")
+    parser.add_argument("--worker", choices=("main", "main_db"), help=argparse.SUPPRESS)
+    parser.add_argument("--drive-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        _worker(args.worker, args.drive_url)
+        return
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    results: List[Dict[str, Any]] = []
+    for name in args.scenario or list(SCENARIOS):
+        results.extend(run_scenario(name, args))
+    path = save_results(results, args.out)
+    logging.info("Resultados gravados em %s", path)
+
+    previous = _latest_results(args.out, exclude=path) if args.compare == "latest" else args.compare
+    if previous:
+        compare(results, previous)
+    elif args.compare:
+        logging.warning("Nenhum resultado anterior em %s para comparar", args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import json
+import logging
+import os
+import shutil
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+_MANIFEST = "manifest.json"
+
+
+def _dumps_line(record: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(record) + b"\n"
+    return json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def _loads_line(line: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+class RunCheckpoint:
+    """Spool local das páginas já baixadas numa execução, para retomá-la com --resume.
+
+    Layout: <root>/<run_id>/manifest.json e <root>/<run_id>/<entidade>/page-000001.ndjson
+    (um registro JSON por linha). Cada página é gravada de forma atômica (tmp + rename), então
+    os arquivos presentes são exatamente as páginas concluídas. O manifesto guarda, por
+    entidade, os parâmetros da consulta, o page_count e se a entidade terminou.
+    """
+
+    def __init__(self, root: str, run_id: str) -> None:
+        self.root = root
+        self.run_id = run_id
+        self.run_dir = os.path.join(root, run_id)
+        os.makedirs(self.run_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._manifest = self._load_manifest()
+
+    @classmethod
+    def create(cls, root: str) -> "RunCheckpoint":
+        run_id = datetime.now().strftime("%Y%m%dT%H%M%S")
+        return cls(root, run_id)
+
+    @classmethod
+    def latest(cls, root: str) -> Optional[str]:
+        """run_id da execução mais recente que ainda tem spool (ou seja, não terminou)."""
+        if not os.path.isdir(root):
+            return None
+        runs = sorted(
+            name for name in os.listdir(root)
+            if os.path.exists(os.path.join(root, name, _MANIFEST))
+        )
+        return runs[-1] if runs else None
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.run_dir, _MANIFEST)
+
+    def _load_manifest(self) -> Dict[str, Any]:
+        path = self._manifest_path()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return {"run_id": self.run_id, "created_at": datetime.now().isoformat(), "entities": {}}
+
+    def _save_manifest(self) -> None:
+        with self._lock:
+            tmp_path = self._manifest_path() + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._manifest, f, indent=2)
+            os.replace(tmp_path, self._manifest_path())
+
+    def _entity_dir(self, entity: str) -> str:
+        return os.path.join(self.run_dir, entity)
+
+    def _page_path(self, entity: str, page: int) -> str:
+        return os.path.join(self._entity_dir(entity), f"page-{page:06d}.ndjson")
+
+    def stored_pages(self, entity: str) -> Set[int]:
+        directory = self._entity_dir(entity)
+        if not os.path.isdir(directory):
+            return set()
+        return {
+            int(name[5:11])
+            for name in os.listdir(directory)
+            if name.startswith("page-") and name.endswith(".ndjson")
+        }
+
+    def begin(self, entity: str, params: Dict[str, Any]) -> Tuple[Optional[int], Set[int]]:
+        """Prepara o spool de `entity`; devolve (page_count conhecido, páginas já gravadas).
+
+        Se a execução anterior usou outros parâmetros (ex.: marca d'água incremental avançou),
+        as páginas antigas não servem e são descartadas.
+        """
+        params = {key: str(value) for key, value in params.items()}
+        info = self._manifest["entities"].get(entity)
+        if info is not None and info.get("params") != params:
+            logging.info("Checkpoint %s: parâmetros de %s mudaram, páginas anteriores descartadas", self.run_id, entity)
+            shutil.rmtree(self._entity_dir(entity), ignore_errors=True)
+            info = None
+        if info is None:
+            info = {"params": params, "page_count": None, "complete": False}
+            self._manifest["entities"][entity] = info
+            self._save_manifest()
+        os.makedirs(self._entity_dir(entity), exist_ok=True)
+        stored = self.stored_pages(entity) if info.get("page_count") else set()
+        if stored:
+            logging.info(
+                "Checkpoint %s: retomando %s com %s de %s páginas já baixadas",
+                self.run_id,
+                entity,
+                len(stored),
+                info["page_count"],
+            )
+        return info.get("page_count"), stored
+
+    def set_page_count(self, entity: str, page_count: int) -> None:
+        self._manifest["entities"][entity]["page_count"] = page_count
+        self._save_manifest()
+
+    def save_page(self, entity: str, page: int, records: List[Dict[str, Any]]) -> None:
+        path = self._page_path(entity, page)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            for record in records:
+                f.write(_dumps_line(record))
+        os.replace(tmp_path, path)
+
+    def load_page(self, entity: str, page: int) -> List[Dict[str, Any]]:
+        with open(self._page_path(entity, page), "rb") as f:
+            return [_loads_line(line) for line in f if line.strip()]
+
+    def finish(self, entity: str) -> bool:
+        """Marca a entidade como concluída se todas as páginas 1..page_count estão gravadas."""
+        info = self._manifest["entities"][entity]
+        page_count = info.get("page_count") or 0
+        missing = set(range(1, page_count + 1)) - self.stored_pages(entity)
+        info["complete"] = not missing
+        self._save_manifest()
+        if missing:
+            logging.warning(
+                "Checkpoint %s: %s ficou com %s páginas faltando; rode novamente com --resume %s",
+                self.run_id,
+                entity,
+                len(missing),
+                self.run_id,
+            )
+        return info["complete"]
+
+    def entity_complete(self, entity: str) -> bool:
+        info = self._manifest["entities"].get(entity)
+        return info is None or bool(info.get("complete"))
+
+    @property
+    def complete(self) -> bool:
+        entities = self._manifest["entities"].values()
+        return bool(entities) and all(info.get("complete") for info in entities)
+
+    def discard(self) -> None:
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+
+    def prune(self, keep: int) -> List[str]:
+        """Apaga os spools de outras execuções em `root`; devolve os run_ids removidos.
+
+        Se esta execução terminou completa, as pendentes anteriores ficaram obsoletas e saem
+        todas. Senão ficam esta e as `keep` - 1 pendentes mais recentes, para um --resume.
+        """
+        if not os.path.isdir(self.root):
+            return []
+        others = sorted(
+            name for name in os.listdir(self.root)
+            if name != self.run_id and os.path.isdir(os.path.join(self.root, name))
+        )
+        if not self.complete:
+            others = others[: max(0, len(others) - max(0, keep - 1))]
+        for run_id in others:
+            shutil.rmtree(os.path.join(self.root, run_id), ignore_errors=True)
+        if others:
+            logging.info("Checkpoint: %s spools antigos apagados (%s)", len(others), ", ".join(others))
+        return others
@@ -0,0 +1,95 @@
+from datetime import date, datetime
+from typing import Any, Callable, List, Optional, Sequence
+
+from schema import EntitySchema
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except Exception:
+    pa = None
+    pc = None
+
+
+def require_pyarrow() -> None:
+    if pa is None:
+        raise ImportError("pyarrow é necessário para RecordBatches Arrow. Instale com: pip install pyarrow")
+
+
+# Timestamps do WMS vêm com offset (ex.: -03:00); mantemos o horário local de parede, como no CSV
+_OFFSET_PATTERN = r"(Z|[+-]\d{2}:?\d{2})$"
+
+
+def _arrow_type(type_name: str) -> "pa.DataType":
+    return {
+        "string": pa.string(),
+        "int": pa.int64(),
+        "float": pa.float64(),
+        "bool": pa.bool_(),
+        "date": pa.date32(),
+        "timestamp": pa.timestamp("us"),
+    }[type_name]
+
+
+def arrow_schema(schema: EntitySchema) -> "pa.Schema":
+    require_pyarrow()
+    return pa.schema([pa.field(col, _arrow_type(schema.type_of(col))) for col in schema.columns])
+
+
+def _to_str(value: Any) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    return str(value)
+
+
+def lenient_converter(type_name: str) -> Callable[[Any], Any]:
+    def convert(value: Any) -> Any:
+        if value is None or value == "":
+            return None
+        try:
+            if type_name == "int":
+                return int(float(value))
+            if type_name == "float":
+                return float(value)
+            if type_name == "bool":
+                return str(value).lower() in ("true", "1", "y", "yes")
+            if type_name == "date":
+                return date.fromisoformat(str(value)[:10])
+            if type_name == "timestamp":
+                return datetime.fromisoformat(str(value).replace("Z", "+00:00")).replace(tzinfo=None)
+        except (TypeError, ValueError):
+            return None
+        return _to_str(value)
+
+    return convert
+
+
+def _column_array(values: List[Any], type_name: str) -> "pa.Array":
+    target = _arrow_type(type_name)
+    if type_name == "string":
+        return pa.array([_to_str(v) for v in values], type=target)
+    try:
+        if type_name in ("timestamp", "date"):
+            arr = pa.array([_to_str(v) or None for v in values], type=pa.string())
+            if type_name == "timestamp":
+                arr = pc.replace_substring_regex(arr, _OFFSET_PATTERN, "")
+            else:
+                arr = pc.utf8_slice_codeunits(arr, 0, 10)
+            return pc.cast(arr, target)
+        return pc.cast(pa.array([None if v == "" else v for v in values]), target)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        # Valores fora do padrão: converte um a um, anulando o que não for convertível
+        convert = lenient_converter(type_name)
+        return pa.array([convert(v) for v in values], type=target)
+
+
+def record_batch(schema: EntitySchema, rows: Sequence[Sequence[Any]], target: Optional["pa.Schema"] = None) -> "pa.RecordBatch":
+    """Converte linhas (tuplas de EntitySchema.row) em um RecordBatch tipado, coluna a coluna."""
+    require_pyarrow()
+    target = target or arrow_schema(schema)
+    columns = list(zip(*rows)) if rows else [() for _ in schema.columns]
+    arrays = [
+        _column_array(list(values), schema.type_of(col))
+        for col, values in zip(schema.columns, columns)
+    ]
+    return pa.RecordBatch.from_arrays(arrays, schema=target)
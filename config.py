@@ -6,7 +6,8 @@ _CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.json")
 
 
 def load_config() -> Dict[str, Any]:
-    with open(_CONFIG_PATH, "r", encoding="utf-8") as f:
+    # ARCO_CONFIG aponta para outro config.json (ex.: benchmarks, ambientes de teste)
+    with open(os.getenv("ARCO_CONFIG") or _CONFIG_PATH, "r", encoding="utf-8") as f:
         cfg = json.load(f)
 
     # Environment overrides for WMS
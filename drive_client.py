@@ -1,17 +1,63 @@
+import hashlib
 import io
 import json
+import logging
 import mimetypes
 import os
-from typing import Optional
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import BinaryIO, Dict, Iterable, NamedTuple, Optional, Sequence, Tuple
+
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
 
 from google.oauth2.service_account import Credentials as ServiceAccountCredentials
 from google.oauth2.credentials import Credentials as UserCredentials
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload, build_http
 
+from metrics import RunMetrics
 
-def authenticate_google_drive(client_secret_file: str, scopes: list[str], token_file: Optional[str] = None) -> any:
+# Status do Drive que valem nova tentativa (limite de taxa e falhas do servidor)
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+_HASH_CHUNK_BYTES = 1024 * 1024
+# Chunks de upload resumable precisam ser múltiplos de 256 KiB
+_CHUNK_ALIGN = 256 * 1024
+_DEFAULT_CHUNK_BYTES = 8 * 1024 * 1024
+# Fontes em iterador são acumuladas em memória até este tamanho; acima disso, em disco
+_SPOOL_MAX_BYTES = 32 * 1024 * 1024
+
+
+def _is_transient(exc: Exception) -> bool:
+    if isinstance(exc, HttpError):
+        return exc.resp.status in _RETRY_STATUSES
+    return isinstance(exc, (OSError, httplib2.HttpLib2Error))
+
+
+class UploadResult(NamedTuple):
+    file_id: str
+    size: int
+    md5: str
+    skipped: bool  # conteúdo idêntico ao do Drive: upload não foi feito
+
+
+def _md5_fileobj(fileobj: BinaryIO) -> Tuple[str, int]:
+    digest = hashlib.md5()
+    size = 0
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(_HASH_CHUNK_BYTES), b""):
+        digest.update(chunk)
+        size += len(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest(), size
+
+
+def load_google_credentials(client_secret_file: str, scopes: list[str], token_file: Optional[str] = None) -> any:
     creds = None
 
     client_secret_data: dict | None = None
@@ -75,7 +121,11 @@ def authenticate_google_drive(client_secret_file: str, scopes: list[str], token_
         raise ValueError(
             "Credenciais do Google não encontradas ou inválidas. Forneça um client_secret.json (service account ou OAuth) e/ou token.json válidos."
         )
+    return creds
 
+
+def authenticate_google_drive(client_secret_file: str, scopes: list[str], token_file: Optional[str] = None) -> any:
+    creds = load_google_credentials(client_secret_file, scopes, token_file)
     service = build("drive", "v3", credentials=creds)
     return service
 
@@ -109,13 +159,33 @@ def upload_or_update_bytes(
     content_bytes: bytes,
     mime_type: Optional[str] = None,
 ) -> str:
+    return upload_or_update_fileobj(
+        service=service,
+        folder_id=folder_id,
+        shared_drive_id=shared_drive_id,
+        file_name=file_name,
+        fileobj=io.BytesIO(content_bytes),
+        mime_type=mime_type,
+    )
+
+
+def upload_or_update_fileobj(
+    service: any,
+    folder_id: str,
+    shared_drive_id: Optional[str],
+    file_name: str,
+    fileobj: BinaryIO,
+    mime_type: Optional[str] = None,
+) -> str:
+    """Como upload_or_update_bytes, mas lendo de um arquivo (ex.: SpooledTemporaryFile) em chunks."""
     if not mime_type:
         guessed, _ = mimetypes.guess_type(file_name)
         mime_type = guessed or "application/octet-stream"
 
     file_id = _find_file_in_folder(service, folder_id, file_name, shared_drive_id)
 
-    media = MediaIoBaseUpload(io.BytesIO(content_bytes), mimetype=mime_type, resumable=True)
+    fileobj.seek(0)
+    media = MediaIoBaseUpload(fileobj, mimetype=mime_type, resumable=True)
 
     if file_id:
         request = service.files().update(
@@ -138,3 +208,254 @@ def upload_or_update_bytes(
         status, response_upload = request.next_chunk()
         # status may be None near completion; no need to print here
     return response_upload.get("id")
+
+
+class DriveUploader:
+    """Uploads para uma pasta do Drive reaproveitando credenciais, serviço e listagem da pasta.
+
+    Autentica e monta o serviço uma vez; na primeira consulta lista a pasta inteira (paginada)
+    num cache nome -> id, atualizado a cada arquivo criado. Pode ser usado por várias threads:
+    cada uma recebe seu próprio cliente HTTP autorizado (httplib2 não é thread-safe).
+
+    No máximo `parallelism` uploads correm ao mesmo tempo (também entre threads de quem
+    chama); 429/5xx e erros de rede são repetidos até `retries` vezes com backoff com jitter.
+    O conteúdo vai em chunks de `chunk_size` bytes numa sessão resumable; se um chunk falha,
+    a mesma sessão é retomada do último byte confirmado pelo Drive, sem recomeçar do zero.
+    Com `skip_unchanged`, o MD5 local é comparado ao `md5Checksum` da listagem e arquivos
+    idênticos não são reenviados.
+    """
+
+    def __init__(
+        self,
+        credentials: any,
+        folder_id: str,
+        shared_drive_id: Optional[str] = None,
+        parallelism: int = 4,
+        retries: int = 3,
+        backoff_base: float = 1.0,
+        skip_unchanged: bool = True,
+        chunk_size: int = _DEFAULT_CHUNK_BYTES,
+        metrics: Optional[RunMetrics] = None,
+    ) -> None:
+        self.credentials = credentials
+        self.folder_id = folder_id
+        self.shared_drive_id = shared_drive_id
+        self.parallelism = max(1, int(parallelism))
+        self.retries = max(1, int(retries))
+        self.backoff_base = backoff_base
+        self.skip_unchanged = skip_unchanged
+        self.chunk_size = max(_CHUNK_ALIGN, int(chunk_size) // _CHUNK_ALIGN * _CHUNK_ALIGN)
+        self._slots = threading.BoundedSemaphore(self.parallelism)
+        # Resultado de cada upload (enviado/sem alterações/falhou) vai para o relatório da execução
+        self.metrics = metrics
+        self.service = build("drive", "v3", credentials=credentials, cache_discovery=False)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # nome -> {"id", "md5Checksum"}
+        self._files: Optional[Dict[str, Dict[str, str]]] = None
+
+    @classmethod
+    def from_config(cls, drive_cfg: dict, base_dir: str, metrics: Optional[RunMetrics] = None) -> "DriveUploader":
+        creds = load_google_credentials(
+            client_secret_file=os.path.join(base_dir, drive_cfg["client_secret_file"]),
+            scopes=drive_cfg.get("scopes", ["https://www.googleapis.com/auth/drive"]),
+            token_file=os.path.join(base_dir, drive_cfg.get("token_file", "token.json")),
+        )
+        return cls(
+            creds,
+            drive_cfg["folder_id"],
+            drive_cfg.get("shared_drive_id"),
+            parallelism=int(drive_cfg.get("upload_parallelism", 4)),
+            retries=int(drive_cfg.get("upload_retries", 3)),
+            backoff_base=float(drive_cfg.get("upload_backoff_base", 1.0)),
+            skip_unchanged=bool(drive_cfg.get("skip_unchanged", True)),
+            chunk_size=int(float(drive_cfg.get("upload_chunk_mb", 8)) * 1024 * 1024),
+            metrics=metrics,
+        )
+
+    def _http(self) -> AuthorizedHttp:
+        http = getattr(self._local, "http", None)
+        if http is None:
+            # build_http: httplib2 configurado para não tratar o 308 do upload resumable como redirect
+            http = AuthorizedHttp(self.credentials, http=build_http())
+            self._local.http = http
+        return http
+
+    def _list_folder(self) -> Dict[str, Dict[str, str]]:
+        files: Dict[str, Dict[str, str]] = {}
+        kwargs = {
+            "q": f"'{self.folder_id}' in parents and trashed = false",
+            "spaces": "drive",
+            "fields": "nextPageToken, files(id, name, md5Checksum)",
+            "pageSize": 1000,
+            "supportsAllDrives": True,
+        }
+        if self.shared_drive_id:
+            kwargs.update({
+                "corpora": "drive",
+                "driveId": self.shared_drive_id,
+                "includeItemsFromAllDrives": True,
+            })
+        page_token = None
+        while True:
+            if page_token:
+                kwargs["pageToken"] = page_token
+            response = self.service.files().list(**kwargs).execute(http=self._http())
+            for item in response.get("files", []):
+                files.setdefault(item["name"], item)
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                break
+        logging.info("Drive: %s arquivos listados na pasta %s", len(files), self.folder_id)
+        return files
+
+    def _remote(self, file_name: str) -> Dict[str, str]:
+        with self._lock:
+            if self._files is None:
+                self._files = self._list_folder()
+            return self._files.get(file_name) or {}
+
+    def refresh(self) -> None:
+        """Descarta a listagem em cache; a próxima consulta relista a pasta (uploader de vida longa)."""
+        with self._lock:
+            self._files = None
+
+    def file_id(self, file_name: str) -> Optional[str]:
+        return self._remote(file_name).get("id")
+
+    def upload_fileobj(self, file_name: str, fileobj: BinaryIO, mime_type: Optional[str] = None) -> UploadResult:
+        """Cria ou atualiza `file_name` na pasta, com nova tentativa em 429/5xx e erros de rede."""
+        started = time.perf_counter()
+        try:
+            result = self._upload_with_retries(file_name, fileobj, mime_type)
+        except Exception:
+            if self.metrics is not None:
+                self.metrics.record_upload(file_name, "failed", seconds=time.perf_counter() - started)
+            raise
+        if self.metrics is not None:
+            outcome = "skipped" if result.skipped else "sent"
+            self.metrics.record_upload(file_name, outcome, result.size, time.perf_counter() - started)
+        return result
+
+    def _upload_with_retries(self, file_name: str, fileobj: BinaryIO, mime_type: Optional[str]) -> UploadResult:
+        md5, size = _md5_fileobj(fileobj)
+        remote = self._remote(file_name)
+        if self.skip_unchanged and remote.get("md5Checksum") == md5:
+            logging.info("Drive: %s sem alterações (md5 %s), upload ignorado", file_name, md5)
+            return UploadResult(remote["id"], size, md5, skipped=True)
+
+        attempt = 0
+        with self._slots:
+            while True:
+                attempt += 1
+                try:
+                    file_id = self._upload(file_name, fileobj, size, mime_type)
+                    with self._lock:
+                        self._files[file_name] = {"id": file_id, "name": file_name, "md5Checksum": md5}
+                    return UploadResult(file_id, size, md5, skipped=False)
+                except (HttpError, OSError, httplib2.HttpLib2Error) as exc:
+                    if not _is_transient(exc) or attempt >= self.retries:
+                        raise
+                    delay = self._backoff(attempt)
+                    logging.warning(
+                        "Upload de %s falhou (%s), tentativa %s/%s; nova tentativa em %.1fs",
+                        file_name,
+                        exc.resp.status if isinstance(exc, HttpError) else exc,
+                        attempt,
+                        self.retries,
+                        delay,
+                    )
+                    time.sleep(delay)
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, self.backoff_base * (2 ** (attempt - 1)))
+
+    def _upload(self, file_name: str, fileobj: BinaryIO, size: int, mime_type: Optional[str]) -> str:
+        if not mime_type:
+            guessed, _ = mimetypes.guess_type(file_name)
+            mime_type = guessed or "application/octet-stream"
+
+        file_id = self.file_id(file_name)
+        fileobj.seek(0)
+        media = MediaIoBaseUpload(fileobj, mimetype=mime_type, chunksize=self.chunk_size, resumable=True)
+        if file_id:
+            request = self.service.files().update(
+                fileId=file_id,
+                media_body=media,
+                fields="id",
+                supportsAllDrives=True,
+            )
+        else:
+            metadata = {"name": file_name, "parents": [self.folder_id]}
+            request = self.service.files().create(
+                body=metadata,
+                media_body=media,
+                fields="id",
+                supportsAllDrives=True,
+            )
+
+        http = self._http()
+        response_upload = None
+        resumes = 0
+        while response_upload is None:
+            try:
+                status, response_upload = request.next_chunk(http=http)
+                resumes = 0
+            except (HttpError, OSError, httplib2.HttpLib2Error) as exc:
+                # Sem sessão criada ainda não há o que retomar: quem chama recomeça o upload
+                if request.resumable_uri is None or not _is_transient(exc) or resumes >= self.retries:
+                    raise
+                resumes += 1
+                delay = self._backoff(resumes)
+                logging.warning(
+                    "Upload de %s interrompido em %s de %s bytes (%s); retomando a sessão em %.1fs",
+                    file_name,
+                    request.resumable_progress,
+                    size,
+                    exc.resp.status if isinstance(exc, HttpError) else exc,
+                    delay,
+                )
+                time.sleep(delay)
+        return response_upload.get("id")
+
+    def upload_bytes(self, file_name: str, content_bytes: bytes, mime_type: Optional[str] = None) -> UploadResult:
+        return self.upload_fileobj(file_name, io.BytesIO(content_bytes), mime_type=mime_type)
+
+    def upload_iter(self, file_name: str, chunks: Iterable[bytes], mime_type: Optional[str] = None) -> UploadResult:
+        """Envia um conteúdo produzido em pedaços (gerador de bytes) sem montá-lo inteiro em memória.
+
+        O Drive precisa do tamanho total e de poder reler chunks em caso de falha, então os
+        pedaços passam por um SpooledTemporaryFile que vai para disco acima de 32 MB.
+        """
+        with tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_BYTES) as fileobj:
+            for chunk in chunks:
+                fileobj.write(chunk)
+            return self.upload_fileobj(file_name, fileobj, mime_type=mime_type)
+
+    def upload_files(self, files: Sequence[Tuple[str, str, Optional[str]]]) -> Dict[str, UploadResult]:
+        """Envia arquivos locais (nome no Drive, caminho, mime) em paralelo; devolve nome -> resultado.
+
+        Uma falha não interrompe os demais envios; ao final, levanta erro listando as que falharam.
+        """
+        def upload(file_name: str, path: str, mime_type: Optional[str]) -> UploadResult:
+            with open(path, "rb") as f:
+                return self.upload_fileobj(file_name, f, mime_type=mime_type)
+
+        results: Dict[str, UploadResult] = {}
+        failures = []
+        with ThreadPoolExecutor(max_workers=self.parallelism, thread_name_prefix="drive") as executor:
+            futures = {executor.submit(upload, *item): item[0] for item in files}
+            for future in as_completed(futures):
+                file_name = futures[future]
+                try:
+                    results[file_name] = future.result()
+                    if not results[file_name].skipped:
+                        logging.info("Uploaded %s to Drive folder %s", file_name, self.folder_id)
+                except Exception:
+                    logging.exception("Falha no upload de %s", file_name)
+                    failures.append(file_name)
+        if failures:
+            raise RuntimeError(f"Falha no upload de {len(failures)} de {len(files)} arquivos: {', '.join(sorted(failures))}")
+        skipped = sum(1 for result in results.values() if result.skipped)
+        logging.info("Drive: %s arquivos enviados, %s sem alterações", len(results) - skipped, skipped)
+        return results
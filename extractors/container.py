@@ -1,11 +1,27 @@
-from typing import Any, Dict, List, Tuple
+import io
+from typing import BinaryIO, Optional, Tuple
 
 from wms_client import WMSClient
-from utils import flatten_one_level, csv_bytes_from_dicts_dynamic
+from utils import DEFAULT_SCHEMA_CACHE, DynamicCsvSink, SchemaCache, flatten_one_level
 
 
-async def extract_container_csv_bytes(client: WMSClient) -> Tuple[str, bytes]:
-    items: List[Dict[str, Any]] = await client.fetch_all("container")
-    flattened = [flatten_one_level(x) for x in items]
-    _, csv_bytes = csv_bytes_from_dicts_dynamic(flattened)
-    return "container.csv", csv_bytes
+async def write_container_csv(
+    client: WMSClient,
+    fileobj: BinaryIO,
+    schema_cache: Optional[SchemaCache] = None,
+) -> Tuple[str, int]:
+    """Grava container.csv página a página; as colunas vêm do cache e crescem com chaves novas."""
+    sink = DynamicCsvSink(fileobj, "container", schema_cache or SchemaCache(DEFAULT_SCHEMA_CACHE))
+    async for page in client.iter_pages("container"):
+        sink.write_records(map(flatten_one_level, page))
+    sink.close()
+    return "container.csv", sink.rows_written
+
+
+async def extract_container_csv_bytes(
+    client: WMSClient,
+    schema_cache: Optional[SchemaCache] = None,
+) -> Tuple[str, bytes]:
+    buffer = io.BytesIO()
+    file_name, _rows = await write_container_csv(client, buffer, schema_cache=schema_cache)
+    return file_name, buffer.getvalue()
@@ -1,7 +1,8 @@
-from typing import Any, Dict, List, Tuple
+import io
+from typing import Any, BinaryIO, Dict, Optional, Tuple
 
 from wms_client import WMSClient
-from utils import flatten_one_level, to_scalar, csv_bytes_from_dicts_dynamic
+from utils import DEFAULT_SCHEMA_CACHE, DynamicCsvSink, SchemaCache, flatten_one_level
 
 
 def _flatten_inventory_record(inv: Dict[str, Any]) -> Dict[str, Any]:
@@ -14,8 +15,23 @@ def _flatten_inventory_record(inv: Dict[str, Any]) -> Dict[str, Any]:
     return flat
 
 
-async def extract_inventory_csv_bytes(client: WMSClient) -> Tuple[str, bytes]:
-    items: List[Dict[str, Any]] = await client.fetch_all("inventory")
-    flattened = [_flatten_inventory_record(x) for x in items]
-    _, csv_bytes = csv_bytes_from_dicts_dynamic(flattened)
-    return "inventory.csv", csv_bytes
+async def write_inventory_csv(
+    client: WMSClient,
+    fileobj: BinaryIO,
+    schema_cache: Optional[SchemaCache] = None,
+) -> Tuple[str, int]:
+    """Grava inventory.csv página a página, sem manter o inventário inteiro em memória."""
+    sink = DynamicCsvSink(fileobj, "inventory", schema_cache or SchemaCache(DEFAULT_SCHEMA_CACHE))
+    async for page in client.iter_pages("inventory"):
+        sink.write_records(map(_flatten_inventory_record, page))
+    sink.close()
+    return "inventory.csv", sink.rows_written
+
+
+async def extract_inventory_csv_bytes(
+    client: WMSClient,
+    schema_cache: Optional[SchemaCache] = None,
+) -> Tuple[str, bytes]:
+    buffer = io.BytesIO()
+    file_name, _rows = await write_inventory_csv(client, buffer, schema_cache=schema_cache)
+    return file_name, buffer.getvalue()
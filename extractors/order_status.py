@@ -1,22 +1,40 @@
-from typing import Any, Dict, List, Tuple
+import io
+from typing import Any, BinaryIO, List, Tuple
 
 from wms_client import WMSClient
-from utils import csv_bytes_from_dicts_fixed
+from schema import EntitySchema
+from utils import FixedCsvSink
 
 
-def _normalize_order_status(status: Dict[str, Any]) -> Dict[str, Any]:
-    return {
-        "id": status.get("id"),
-        "description": status.get("description"),
-    }
+SCHEMA = EntitySchema(
+    "order_status",
+    [
+        "id", "description"
+    ],
+    types={"id": "int"},
+)
 
 
 def _fieldnames() -> List[str]:
-    return ["id", "description"]
+    return list(SCHEMA.columns)
+
+
+async def extract_order_status(client: WMSClient, sink: Any) -> int:
+    """Normaliza cada página e a entrega a `sink` (CSV, Parquet, Arrow...) assim que chega."""
+    rows = 0
+    async for page in client.iter_pages("order_status", fields=SCHEMA.api_fields):
+        sink.write_rows(SCHEMA.rows(page))
+        rows += len(page)
+    sink.close()
+    return rows
+
+
+async def write_order_status_csv(client: WMSClient, fileobj: BinaryIO) -> Tuple[str, int]:
+    rows = await extract_order_status(client, FixedCsvSink(fileobj, _fieldnames()))
+    return "order_status.csv", rows
 
 
 async def extract_order_status_csv_bytes(client: WMSClient) -> Tuple[str, bytes]:
-    items: List[Dict[str, Any]] = await client.fetch_all("order_status")
-    normalized = [_normalize_order_status(x) for x in items]
-    csv_bytes = csv_bytes_from_dicts_fixed(normalized, _fieldnames())
-    return "order_status.csv", csv_bytes
+    buffer = io.BytesIO()
+    file_name, _rows = await write_order_status_csv(client, buffer)
+    return file_name, buffer.getvalue()
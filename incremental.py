@@ -0,0 +1,278 @@
+import csv
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from utils import FixedCsvSink
+
+
+def _parse_ts(value: Any) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        ts = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts
+
+
+class IncrementalState:
+    """Marca d'água (mod_ts) e snapshot local por entidade para extrações incrementais."""
+
+    def __init__(
+        self,
+        state_dir: str,
+        overlap_minutes: float = 10.0,
+        entities: Optional[Sequence[str]] = None,
+        full_refresh: bool = False,
+        warehouse: Any = None,
+    ) -> None:
+        self.state_dir = state_dir
+        self.overlap = timedelta(minutes=overlap_minutes)
+        self.entities = set(entities) if entities is not None else None
+        self.full_refresh = full_refresh
+        # Com o warehouse DuckDB (consolidation.Warehouse) as tabelas raw_* fazem o papel do snapshot
+        self.warehouse = warehouse
+        os.makedirs(self.state_dir, exist_ok=True)
+
+    @classmethod
+    def from_config(
+        cls,
+        cfg: Dict[str, Any],
+        base_dir: str,
+        full_refresh: bool = False,
+        warehouse: Any = None,
+    ) -> Optional["IncrementalState"]:
+        inc = cfg.get("incremental") or {}
+        if not inc.get("enabled", False):
+            return None
+        state_dir = inc.get("state_dir", "state")
+        if not os.path.isabs(state_dir):
+            state_dir = os.path.join(base_dir, state_dir)
+        return cls(
+            state_dir=state_dir,
+            overlap_minutes=float(inc.get("overlap_minutes", 10.0)),
+            entities=inc.get("entities", ["order_hdr", "order_dtl"]),
+            full_refresh=full_refresh,
+            warehouse=warehouse,
+        )
+
+    def enabled_for(self, entity: str) -> bool:
+        return self.entities is None or entity in self.entities
+
+    def _watermarks_path(self) -> str:
+        return os.path.join(self.state_dir, "watermarks.json")
+
+    def _snapshot_path(self, entity: str) -> str:
+        return os.path.join(self.state_dir, f"{entity}.csv")
+
+    def _has_snapshot(self, entity: str) -> bool:
+        if self.warehouse is not None:
+            return self.warehouse.has_rows(entity)
+        return os.path.exists(self._snapshot_path(entity))
+
+    def _load_watermarks(self) -> Dict[str, str]:
+        path = self._watermarks_path()
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_watermark(self, entity: str, value: str) -> None:
+        marks = self._load_watermarks()
+        marks[entity] = value
+        tmp_path = self._watermarks_path() + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(marks, f, indent=2)
+        os.replace(tmp_path, self._watermarks_path())
+
+    def watermark(self, entity: str) -> Optional[str]:
+        return self._load_watermarks().get(entity)
+
+    def filter_params(self, entity: str) -> Dict[str, str]:
+        """Parâmetros de filtro para buscar só registros modificados desde a última execução."""
+        if self.full_refresh or not self.enabled_for(entity):
+            return {}
+        # Sem snapshot local não há com o que mesclar o delta: faz carga completa
+        if not self._has_snapshot(entity):
+            return {}
+        mark = _parse_ts(self.watermark(entity))
+        if mark is None:
+            return {}
+        since = mark - self.overlap
+        return {"mod_ts__gte": since.isoformat()}
+
+    def snapshot_sink(
+        self,
+        entity: str,
+        fieldnames: Sequence[str],
+        sink: Any,
+        is_delta: bool,
+        key: str = "id",
+        complete: Optional[Callable[[], bool]] = None,
+    ) -> "WatermarkSink":
+        """Envolve `sink` para que as páginas também atualizem o snapshot local de `entity`.
+
+        Com warehouse, o próprio sink (upsert por id) já mantém o histórico: só a marca
+        d'água é acompanhada aqui. `complete` é consultado no close(): se faltaram páginas,
+        a marca d'água não avança e um snapshot de carga completa não é substituído.
+        """
+        if self.warehouse is not None:
+            return WatermarkSink(self, entity, fieldnames, sink, is_delta=is_delta, complete=complete)
+        return SnapshotMergeSink(self, entity, fieldnames, sink, is_delta=is_delta, key=key, complete=complete)
+
+
+class WatermarkSink:
+    """Repassa as páginas ao sink e grava a maior mod_ts vista depois que ele fecha sem erro."""
+
+    def __init__(
+        self,
+        state: IncrementalState,
+        entity: str,
+        fieldnames: Sequence[str],
+        sink: Any,
+        is_delta: bool,
+        complete: Optional[Callable[[], bool]] = None,
+    ) -> None:
+        self.state = state
+        self.entity = entity
+        self.fieldnames = list(fieldnames)
+        self.sink = sink
+        self.is_delta = is_delta
+        self.complete = complete
+        self.rows_changed = 0
+        self._ts_idx = self.fieldnames.index("mod_ts")
+        self._latest_raw = state.watermark(entity) if is_delta else None
+        self._latest = _parse_ts(self._latest_raw)
+
+    def _observe(self, row: Sequence[Any]) -> None:
+        raw = row[self._ts_idx]
+        ts = _parse_ts(raw)
+        if ts is not None and (self._latest is None or ts > self._latest):
+            self._latest, self._latest_raw = ts, str(raw)
+
+    def write_rows(self, rows: Iterable[Sequence[Any]]) -> None:
+        rows = list(rows)
+        for row in rows:
+            self._observe(row)
+        self.rows_changed += len(rows)
+        self.sink.write_rows(rows)
+
+    def _extraction_complete(self) -> bool:
+        if self.complete is None or self.complete():
+            return True
+        # Registros de uma página perdida podem ter mod_ts abaixo da maior vista: a próxima
+        # execução precisa buscá-los de novo a partir da marca d'água anterior
+        logging.warning(
+            "Incremental %s: extração incompleta (páginas com falha); marca d'água mantida em %s",
+            self.entity,
+            self.state.watermark(self.entity),
+        )
+        return False
+
+    def close(self) -> None:
+        self.sink.close()
+        if self._latest_raw and self._extraction_complete():
+            self.state._save_watermark(self.entity, self._latest_raw)
+        logging.info(
+            "Incremental %s: %s registros alterados (marca d'água: %s)",
+            self.entity,
+            self.rows_changed,
+            self.state.watermark(self.entity),
+        )
+
+
+class SnapshotMergeSink(WatermarkSink):
+    """Sink que mescla o delta no snapshot local (chave `key`) e repassa o resultado ao sink final.
+
+    As linhas são tuplas na ordem de `fieldnames`. Em carga completa elas vão direto para o
+    sink e para o novo snapshot. Em carga incremental só o delta fica em memória; o snapshot
+    anterior é relido em streaming no close().
+    """
+
+    def __init__(
+        self,
+        state: IncrementalState,
+        entity: str,
+        fieldnames: Sequence[str],
+        sink: Any,
+        is_delta: bool,
+        key: str = "id",
+        complete: Optional[Callable[[], bool]] = None,
+    ) -> None:
+        super().__init__(state, entity, fieldnames, sink, is_delta=is_delta, complete=complete)
+        self._key_idx = self.fieldnames.index(key)
+        self._delta: Dict[str, Sequence[Any]] = {}
+        self._snapshot_path = state._snapshot_path(entity)
+        self._tmp_path = self._snapshot_path + ".tmp"
+        self._tmp_file = open(self._tmp_path, "wb")
+        self._snapshot = FixedCsvSink(self._tmp_file, self.fieldnames)
+
+    def write_rows(self, rows: Iterable[Sequence[Any]]) -> None:
+        rows = list(rows)
+        for row in rows:
+            self._observe(row)
+        self.rows_changed += len(rows)
+        if self.is_delta:
+            for row in rows:
+                self._delta[str(row[self._key_idx])] = row
+        else:
+            self._snapshot.write_rows(rows)
+            self.sink.write_rows(rows)
+
+    def _previous_rows(self) -> Iterator[Sequence[Any]]:
+        # O CSV grava None como campo vazio; na releitura o vazio volta a ser None, como na carga completa
+        with open(self._snapshot_path, "r", encoding="utf-8", newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader, None) or []
+            if header == self.fieldnames:
+                for row in reader:
+                    yield [value if value != "" else None for value in row]
+                return
+            # Snapshot gravado com outra lista de colunas: reordena por nome
+            positions = {name: idx for idx, name in enumerate(header)}
+            order = [positions.get(name) for name in self.fieldnames]
+            for row in reader:
+                yield [row[idx] or None if idx is not None and idx < len(row) else None for idx in order]
+
+    def close(self) -> None:
+        if self.is_delta:
+            if os.path.exists(self._snapshot_path):
+                batch: List[Sequence[Any]] = []
+                for row in self._previous_rows():
+                    if row[self._key_idx] in self._delta:
+                        continue
+                    batch.append(row)
+                    if len(batch) >= 5000:
+                        self._snapshot.write_rows(batch)
+                        self.sink.write_rows(batch)
+                        batch = []
+                self._snapshot.write_rows(batch)
+                self.sink.write_rows(batch)
+            delta = list(self._delta.values())
+            self._snapshot.write_rows(delta)
+            self.sink.write_rows(delta)
+
+        self._snapshot.close()
+        self._tmp_file.close()
+        complete = self._extraction_complete()
+        if complete or self.is_delta:
+            # Delta incompleto ainda é snapshot anterior + o que chegou; carga completa incompleta não
+            os.replace(self._tmp_path, self._snapshot_path)
+        else:
+            os.remove(self._tmp_path)
+        if self._latest_raw and complete:
+            self.state._save_watermark(self.entity, self._latest_raw)
+        self.sink.close()
+
+        logging.info(
+            "Snapshot incremental %s: %s registros alterados, %s no total (marca d'água: %s)",
+            self.entity,
+            self.rows_changed,
+            self._snapshot.rows_written,
+            self.state.watermark(self.entity),
+        )
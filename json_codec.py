@@ -0,0 +1,38 @@
+import json
+from typing import Any, Callable, Tuple
+
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+try:
+    import msgspec
+except Exception:
+    msgspec = None
+
+
+# Funções de módulo (e não lambdas) para poderem ser enviadas a um ProcessPoolExecutor
+
+def _loads_orjson(body: bytes) -> Any:
+    return orjson.loads(body)
+
+
+def _loads_msgspec(body: bytes) -> Any:
+    return msgspec.json.decode(body)
+
+
+def _loads_stdlib(body: bytes) -> Any:
+    return json.loads(body)
+
+
+def resolve_decoder(name: str = "auto") -> Tuple[str, Callable[[bytes], Any]]:
+    """Escolhe o decodificador JSON: orjson ou msgspec quando instalados, senão a stdlib."""
+    name = (name or "auto").lower()
+    if name in ("auto", "orjson") and orjson is not None:
+        return "orjson", _loads_orjson
+    if name in ("auto", "msgspec") and msgspec is not None:
+        return "msgspec", _loads_msgspec
+    if name not in ("auto", "json", "stdlib"):
+        raise ValueError(f"Decodificador JSON indisponível: {name}")
+    return "json", _loads_stdlib
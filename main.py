@@ -1,42 +1,167 @@
+import argparse
 import asyncio
+import functools
 import os
-import io
 import logging
-from typing import List, Tuple
-import pandas as pd
+import shutil
+import tempfile
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 import duckdb as ddb
 
+from checkpoint import RunCheckpoint
 from config import load_config
+from consolidation import BASE_STATUS_QUERY, DuckDBTableSink, InventorySnapshot, Warehouse, copy_to
+from incremental import IncrementalState
+from metrics import RunMetrics, TimedSink
+from utils import OutputSpec, output_spec
 from wms_client import WMSClient
-from drive_client import authenticate_google_drive, upload_or_update_bytes
-from extractors.order_hdr import extract_order_hdr_csv_bytes
-from extractors.order_dtl import extract_order_dtl_csv_bytes
-from extractors.order_status import extract_order_status_csv_bytes
+from drive_client import DriveUploader
+from extractors import inventory, order_dtl, order_hdr, order_status
 
+# entidade -> (schema, função de extração, aceita modo incremental)
+_ORDER_ENTITIES = {
+    "order_hdr": (order_hdr.SCHEMA, order_hdr.extract_order_hdr, True),
+    "order_dtl": (order_dtl.SCHEMA, order_dtl.extract_order_dtl, True),
+    "order_status": (order_status.SCHEMA, order_status.extract_order_status, False),
+}
+_INVENTORY_MODES = ("delta", "full", "both")
 
-async def _extract_all(client: WMSClient) -> List[Tuple[str, bytes]]:
-    results: List[Tuple[str, bytes]] = []
 
-    hdr_name, hdr_bytes = await extract_order_hdr_csv_bytes(client)
-    results.append((hdr_name, hdr_bytes))
+async def _write_inventory(client: WMSClient, path: str) -> int:
+    with open(path, "wb") as f:
+        _file_name, rows = await inventory.write_inventory_csv(client, f)
+    return rows
 
-    dtl_name, dtl_bytes = await extract_order_dtl_csv_bytes(client)
-    results.append((dtl_name, dtl_bytes))
 
-    st_name, st_bytes = await extract_order_status_csv_bytes(client)
-    results.append((st_name, st_bytes))
+async def _extract_all(
+    client: WMSClient,
+    con: Any,
+    state: Optional[IncrementalState] = None,
+    warehouse: Optional[Warehouse] = None,
+    metrics: Optional[RunMetrics] = None,
+    inventory_csv: Optional[str] = None,
+) -> Dict[str, int]:
+    """Extrai as entidades de orders em paralelo, carregando cada página direto em raw_<entidade> no DuckDB.
 
-    return results
+    Com `inventory_csv`, o inventário é extraído junto, em CSV de schema dinâmico nesse caminho.
+    """
+    entities = list(_ORDER_ENTITIES)
+    jobs = []
+    for entity in _ORDER_ENTITIES:
+        schema, extract, incremental = _ORDER_ENTITIES[entity]
+        kwargs = {"state": state} if incremental else {}
+        if warehouse is not None:
+            # Carga incremental faz upsert; carga completa também remove o que sumiu do WMS
+            is_delta = bool(incremental and state and state.filter_params(entity))
+            # (sem remoção se alguma página falhar: o id pode estar só na página perdida)
+            complete = functools.partial(client.entity_complete, entity)
+            sink = warehouse.staging_sink(entity, replace=not is_delta, complete=complete)
+        else:
+            sink = DuckDBTableSink(con, f"raw_{entity}", schema)
+        if metrics is not None:
+            sink = TimedSink(sink, metrics, load_stage="duckdb_load")
+        jobs.append(extract(client, sink, **kwargs))
+    if inventory_csv:
+        entities.append("inventory")
+        jobs.append(_write_inventory(client, inventory_csv))
 
+    # Todas as entidades em paralelo, sobre a mesma sessão e o mesmo limite global de requisições
+    async with client:
+        counts = await asyncio.gather(*jobs)
+    return dict(zip(entities, counts))
 
-def run() -> None:
-    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
-    cfg = load_config()
 
-    wms = cfg["wms"]
-    drive_cfg = cfg["drive"]
+def _export(con: Any, source: str, spec: OutputSpec, work_dir: str) -> Tuple[str, str, str]:
+    """Exporta tabela/consulta do DuckDB via COPY; devolve (nome no Drive, caminho local, mime)."""
+    path = os.path.join(work_dir, spec.file_name)
+    copy_to(con, source, path, fmt=spec.format, compression=spec.compression)
+    return spec.file_name, path, spec.mime_type
+
+
+def _open_warehouse(cfg: Dict[str, Any], base_dir: str) -> Tuple[Any, Optional[Warehouse]]:
+    """Conexão DuckDB: em disco quando `warehouse.path` está configurado, senão em memória."""
+    path = (cfg.get("warehouse") or {}).get("path")
+    if not path:
+        return ddb.connect(), None
+    if not os.path.isabs(path):
+        path = os.path.join(base_dir, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    con = ddb.connect(path)
+    schemas = {entity: spec[0] for entity, spec in _ORDER_ENTITIES.items()}
+    return con, Warehouse(con, schemas)
+
+
+def _inventory_snapshot(cfg: Dict[str, Any], base_dir: str) -> Optional[InventorySnapshot]:
+    """Snapshot do inventário (`inventory.enabled`); o modo define se sai delta, dump completo ou ambos."""
+    inventory_cfg = cfg.get("inventory") or {}
+    if not inventory_cfg.get("enabled", False):
+        return None
+    mode = inventory_cfg.get("mode", "delta")
+    if mode not in _INVENTORY_MODES:
+        raise ValueError(f"inventory.mode inválido: {mode} (use {', '.join(_INVENTORY_MODES)})")
+    path = inventory_cfg.get("snapshot_path", os.path.join("state", "inventory_snapshot.parquet"))
+    if not os.path.isabs(path):
+        path = os.path.join(base_dir, path)
+    return InventorySnapshot(path)
+
+
+def _export_inventory(
+    con: Any,
+    snapshot: InventorySnapshot,
+    csv_path: str,
+    mode: str,
+    outputs: Dict[str, Any],
+    work_dir: str,
+    complete: bool = True,
+) -> List[Tuple[str, str, str]]:
+    snapshot.load(con, csv_path)
+    exports = []
+    if mode in ("full", "both"):
+        exports.append(
+            _export(con, snapshot.full_query(), output_spec(outputs.get("inventory"), "inventory.csv"), work_dir)
+        )
+    if mode in ("delta", "both") and not complete:
+        # Posições de uma página perdida sairiam como `removed` (e como `added` na execução seguinte)
+        logging.warning("Inventário: extração incompleta (páginas com falha); delta não gerado e snapshot mantido")
+    elif mode in ("delta", "both"):
+        spec = output_spec(outputs.get("inventory_delta"), "inventory_delta.csv")
+        path = os.path.join(work_dir, spec.file_name)
+        counts = snapshot.write_delta(con, path, fmt=spec.format, compression=spec.compression)
+        logging.info(
+            "Inventário: %s posições novas, %s removidas, %s com quantidade alterada",
+            counts["added"],
+            counts["removed"],
+            counts["qty_changed"],
+        )
+        exports.append((spec.file_name, path, spec.mime_type))
+    return exports
+
+
+def _open_checkpoint(wms: Dict[str, Any], base_dir: str, resume: Optional[str]) -> Optional[RunCheckpoint]:
+    """Spool de páginas da execução: novo, ou o de `resume` ("latest" = o mais recente pendente)."""
+    cp_cfg = wms.get("checkpoint") or {}
+    if not cp_cfg.get("enabled", False) and resume is None:
+        return None
+    root = cp_cfg.get("dir", os.path.join("state", "runs"))
+    if not os.path.isabs(root):
+        root = os.path.join(base_dir, root)
+    if resume is not None:
+        run_id = RunCheckpoint.latest(root) if resume == "latest" else resume
+        if run_id and os.path.isdir(os.path.join(root, run_id)):
+            logging.info("Retomando a execução %s", run_id)
+            return RunCheckpoint(root, run_id)
+        logging.warning("Nenhuma execução pendente para retomar (%s); iniciando uma nova", resume)
+    checkpoint = RunCheckpoint.create(root)
+    logging.info("Checkpoint da execução %s em %s", checkpoint.run_id, checkpoint.run_dir)
+    return checkpoint
+
 
-    client = WMSClient(
+def build_client(
+    wms: Dict[str, Any],
+    checkpoint: Optional[RunCheckpoint] = None,
+    metrics: Optional[RunMetrics] = None,
+) -> WMSClient:
+    return WMSClient(
         base_url=wms["base_url"],
         username=wms["username"],
         password=wms["password"],
@@ -45,124 +170,165 @@ def run() -> None:
         timeout_seconds=float(wms.get("default_timeout", 30.0)),
         retries=int(wms.get("default_retries", 3)),
         backoff_base=float(wms.get("default_backoff_base", 0.5)),
+        entity_weights=wms.get("entity_weights"),
+        adaptive=bool(wms.get("adaptive_concurrency", False)),
+        min_concurrency=int(wms.get("min_concurrency", 1)),
+        max_concurrency=wms.get("max_concurrency"),
+        speculative_pages=int(wms.get("speculative_pages", 0)),
+        page_size=wms.get("default_page_size"),
+        project_fields=bool(wms.get("project_fields", True)),
+        decoder=wms.get("json_decoder", "auto"),
+        decode_executor=wms.get("decode_executor", "thread"),
+        checkpoint=checkpoint,
+        metrics=metrics,
     )
 
-    results = asyncio.run(_extract_all(client))
-
-    name_to_bytes = {name: content for name, content in results}
-
-    # Carrega CSVs de orders em memória como DataFrames
-    dtl_df = None
-    hdr_df = None
-    st_df = None
-    if "order_dtl.csv" in name_to_bytes and "order_hdr.csv" in name_to_bytes and "order_status.csv" in name_to_bytes:
-        dtl_df = pd.read_csv(io.BytesIO(name_to_bytes["order_dtl.csv"]))
-        hdr_df = pd.read_csv(io.BytesIO(name_to_bytes["order_hdr.csv"]))
-        st_df = pd.read_csv(io.BytesIO(name_to_bytes["order_status.csv"]))
-
-    combined_csv_bytes: bytes | None = None
-    if dtl_df is not None and hdr_df is not None and st_df is not None:
-        con = ddb.connect()
-        con.register("dtl", dtl_df)
-        con.register("hdr", hdr_df)
-        con.register("st", st_df)
-        combined_df = con.execute(
-            """
-            SELECT 
-                h.facility_id_key AS filial,
-                CAST(d.create_ts AS DATE) AS dt_criacao,
-                CAST(d.create_ts AS TIME) AS hr_criacao,
-                CAST(d.mod_ts AS DATE) AS dt_modificacao,
-                CAST(d.mod_ts AS TIME) AS hr_modificacao,
-                h.cust_short_text_1 AS orderm_frete,
-                h.order_nbr AS remessa,
-                d.item_id_key AS item,
-                d.ord_qty AS qtd_pedido,
-                d.orig_ord_qty AS qtd_pedido_original,
-                d.alloc_qty AS qtd_alocada,
-                h.order_type_id_key AS tipo_pedido,
-                h.ord_date AS dt_ordem,
-                h.req_ship_date AS dt_embarque_obrigatoria,
-                 CASE
-                     WHEN h.status_id = 0  THEN 'Criado'
-                     WHEN h.status_id = 10 THEN 'Parcialmente alocado'
-                     WHEN h.status_id = 20 THEN 'Alocado'
-                     WHEN h.status_id = 25 THEN 'Em Separação'
-                     WHEN h.status_id = 27 THEN 'Separado'
-                     WHEN h.status_id = 30 THEN 'Em Conferência'
-                     WHEN h.status_id = 40 AND h.cust_field_2 <> '' THEN 'Faturado'
-                     WHEN h.status_id = 40 THEN 'Conferido'
-                     WHEN h.status_id = 50 THEN 'Carregado'
-                     WHEN h.status_id = 90 THEN 'Expedido'
-                     WHEN h.status_id = 99 THEN 'Cancelado'
-                     ELSE 'Desconhecido'
-                 END AS status_remessa,
-                h.cust_name AS nome_cliente,
-                h.cust_addr AS endereco_cliente,	
-                h.cust_addr2 AS numero_end_cliente,
-                h.cust_city AS cidade_cliente,
-                h.cust_state AS estado_cliente,
-                h.cust_zip AS cep_cliente,
-                h.cust_nbr AS cod_cliente,	 
-                h.shipto_name AS cliente_entrega,
-                h.shipto_addr AS endereco_entrega,
-                h.shipto_addr2 AS numero_entrega, 	
-                h.shipto_city AS cidade_cliente_entrega,	
-                h.shipto_state AS estado_cliente_entrega,	
-                h.shipto_zip AS cep_cliente_entrega,
-                h.priority AS prioridade,
-                CAST(h.order_shipped_ts AS DATE) AS data_expedicao,
-                h.cust_field_2 AS nota_fiscal,
-                h.cust_date_1 AS dt_faturamento,
-                h.cust_short_text_2 AS erro_zero,
-                h.cust_long_text_1 AS transportadora,
-                h.cust_long_text_2 AS tipo_pedido_extra
-            FROM dtl d
-            LEFT JOIN hdr h ON d.order_id_id = h.id
-            LEFT JOIN st  s ON h.status_id = s.id
-            WHERE h.order_type_id_key <> '91'
-            """
-        ).df()
-        combined_csv_bytes = combined_df.to_csv(index=False, sep=',').encode("utf-8")
 
+def run(
+    full_refresh: bool = False,
+    resume: Optional[str] = None,
+    cfg: Optional[Dict[str, Any]] = None,
+    client: Optional[WMSClient] = None,
+    uploader: Optional[DriveUploader] = None,
+    run_async: Callable[[Awaitable[Any]], Any] = asyncio.run,
+) -> RunMetrics:
+    """Executa o pipeline uma vez e devolve as métricas da execução.
+
+    O modo serviço (scheduler.py) passa `cfg`, um cliente WMS já aberto, o uploader já autenticado
+    e um `run_async` que roda a extração no seu loop de eventos, reaproveitando sessão e credenciais.
+    """
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    cfg = cfg if cfg is not None else load_config()
     base_dir = os.path.dirname(__file__)
-    client_secret_path = os.path.join(base_dir, drive_cfg["client_secret_file"])
-    token_path = os.path.join(base_dir, drive_cfg.get("token_file", "token.json"))
 
-    service = authenticate_google_drive(
-        client_secret_file=client_secret_path,
-        scopes=drive_cfg.get("scopes", ["https://www.googleapis.com/auth/drive"]),
-        token_file=token_path,
-    )
-    folder_id = drive_cfg["folder_id"]
-    shared_drive_id = drive_cfg.get("shared_drive_id")
-
-    # Primeiro envia as extrações que não são orders
-    for file_name, content_bytes in results:
-        if file_name in ("order_dtl.csv", "order_hdr.csv", "order_status.csv"):
-            continue
-        upload_or_update_bytes(
-            service=service,
-            folder_id=folder_id,
-            shared_drive_id=shared_drive_id,
-            file_name=file_name,
-            content_bytes=content_bytes,
-            mime_type="text/csv",
-        )
-        logging.info("Uploaded %s to Drive folder %s", file_name, folder_id)
-
-    # Depois envia o resultado combinado das orders
-    if combined_csv_bytes is not None:
-        upload_or_update_bytes(
-            service=service,
-            folder_id=folder_id,
-            shared_drive_id=shared_drive_id,
-            file_name="base_status_pedidos_wms_sae.csv",
-            content_bytes=combined_csv_bytes,
-            mime_type="text/csv",
-        )
-        logging.info("Uploaded %s to Drive folder %s", "base_status_pedidos_wms_sae.csv", folder_id)
+    # Relatório da execução (JSON em metrics.report_dir e, opcional, textfile do Prometheus)
+    metrics = RunMetrics.from_config(cfg, base_dir, pipeline="main")
+    error: Optional[BaseException] = None
+    try:
+        _run(cfg, base_dir, metrics, full_refresh, resume, client, uploader, run_async)
+    except BaseException as exc:
+        error = exc
+        raise
+    finally:
+        metrics.finish(error)
+        metrics.log_summary()
+        path = metrics.write_report()
+        if path:
+            logging.info("Relatório da execução gravado em %s", path)
+    return metrics
+
+
+def _run(
+    cfg: Dict[str, Any],
+    base_dir: str,
+    metrics: RunMetrics,
+    full_refresh: bool,
+    resume: Optional[str],
+    client: Optional[WMSClient],
+    uploader: Optional[DriveUploader],
+    run_async: Callable[[Awaitable[Any]], Any],
+) -> None:
+    wms = cfg["wms"]
+    drive_cfg = cfg["drive"]
+
+    checkpoint = _open_checkpoint(wms, base_dir, resume)
+    if client is None:
+        client = build_client(wms, checkpoint=checkpoint, metrics=metrics)
+    else:
+        client.checkpoint = checkpoint
+        client.metrics = metrics
+
+    # Warehouse DuckDB em disco (opcional): raw_* persistem entre execuções com upsert por id
+    con, warehouse = _open_warehouse(cfg, base_dir)
+
+    work_dir = tempfile.mkdtemp(prefix="arco_")
+    try:
+        # Modo incremental (opcional): busca só o que mudou desde a última marca d'água de mod_ts
+        state = IncrementalState.from_config(wms, base_dir, full_refresh=full_refresh, warehouse=warehouse)
+
+        # Inventário (opcional): extraído junto e entregue como delta contra o snapshot anterior
+        snapshot = _inventory_snapshot(cfg, base_dir)
+
+        outputs = cfg.get("outputs", {})
+        # Nomes/compressões inválidos em `outputs` falham antes da extração, não depois dela
+        for name, value in outputs.items():
+            output_spec(value, f"{name}.csv")
+        inventory_csv = os.path.join(work_dir, "inventory_raw.csv") if snapshot is not None else None
+        with metrics.stage("extract"):
+            run_async(
+                _extract_all(client, con, state=state, warehouse=warehouse, metrics=metrics, inventory_csv=inventory_csv)
+            )
+
+        exports: List[Tuple[str, str, str]] = []
+        with metrics.stage("export"):
+            # Extrações individuais só são enviadas quando configuradas em Parquet ou CSV comprimido
+            # (as CSV simples só alimentam o join)
+            for entity in _ORDER_ENTITIES:
+                spec = output_spec(outputs.get(entity), f"{entity}.csv")
+                if spec.format == "parquet" or spec.compression:
+                    exports.append(_export(con, f"SELECT * FROM raw_{entity} ORDER BY id", spec, work_dir))
+            # Consolidado: o DuckDB grava (e comprime) o arquivo direto com COPY, sem passar por DataFrame
+            combined_spec = output_spec(outputs.get("base_status_pedidos_wms_sae"), "base_status_pedidos_wms_sae.csv")
+            combined_source = BASE_STATUS_QUERY
+            if warehouse is not None and (cfg.get("warehouse") or {}).get("incremental_base_status", False):
+                # Materialização incremental: só as remessas alteradas nesta execução são recalculadas
+                combined_source = Warehouse.export_query(warehouse.refresh_base_status())
+            exports.append(_export(con, combined_source, combined_spec, work_dir))
+            if snapshot is not None:
+                mode = cfg["inventory"].get("mode", "delta")
+                inventory_complete = client.entity_complete("inventory")
+                exports.extend(
+                    _export_inventory(
+                        con, snapshot, inventory_csv, mode, outputs, work_dir, complete=inventory_complete
+                    )
+                )
+        # Libera o arquivo do warehouse antes dos uploads (close() é idempotente)
+        con.close()
+
+        # Autentica e lista a pasta de destino uma única vez para todos os uploads
+        # (no modo serviço o uploader já vem autenticado; só a listagem é refeita)
+        if uploader is None:
+            uploader = DriveUploader.from_config(drive_cfg, base_dir, metrics=metrics)
+        else:
+            uploader.metrics = metrics
+            uploader.refresh()
+
+        # Uploads em paralelo (drive.upload_parallelism), com nova tentativa por arquivo
+        with metrics.stage("upload"):
+            uploader.upload_files(exports)
+    finally:
+        # No modo serviço o processo segue vivo: a conexão não pode vazar quando a execução falha
+        con.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    # O snapshot do inventário só avança depois que o delta (de uma extração completa) foi entregue
+    if snapshot is not None and inventory_complete:
+        snapshot.commit()
+
+    # Execução concluída: o spool só é mantido se faltaram páginas (para um --resume posterior)
+    if checkpoint is not None:
+        if checkpoint.complete:
+            checkpoint.discard()
+        else:
+            logging.warning("Execução incompleta; retome com: python main.py --resume %s", checkpoint.run_id)
+        # Sem isso, cada execução incompleta do modo serviço deixaria um spool para sempre em state/runs
+        checkpoint.prune(int((wms.get("checkpoint") or {}).get("keep", 3)))
 
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description="Extração WMS -> DuckDB -> Google Drive")
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Ignora a marca d'água incremental e refaz a carga completa",
+    )
+    parser.add_argument(
+        "--resume",
+        nargs="?",
+        const="latest",
+        metavar="RUN_ID",
+        help="Retoma uma execução interrompida (a mais recente, se RUN_ID não for informado), "
+        "buscando só as páginas que faltam",
+    )
+    args = parser.parse_args()
+    run(full_refresh=args.full, resume=args.resume)
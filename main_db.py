@@ -5,22 +5,39 @@ Executa múltiplas queries SQL (base_status_pedidos_wms_sae.sql e produtividade_
 no Postgres local, gera CSVs e envia para o Google Drive usando drive_client.py.
 
 Dependências:
-  pip install pandas psycopg[binary] google-api-python-client google-auth
+  pip install pandas psycopg[binary] psycopg-pool google-api-python-client google-auth
 
 Conexão ao Postgres via variáveis de ambiente:
   PGHOST, PGPORT, PGUSER, PGPASSWORD, PGDATABASE
 
 Configurações do Google Drive via config.json.
+
+As queries vêm de database.queries e/ou de todos os .sql em database.sql_dir e rodam em
+paralelo (database.parallelism), cada uma com uma conexão do pool (psycopg_pool; psycopg2.pool
+com psycopg2) e com exportação e upload sobrepostos às das demais.
+
+Com database.export_mode = "copy" (COPY ... TO STDOUT) ou "cursor" (cursor nomeado no
+servidor, lido em lotes), o resultado é gravado em streaming num arquivo temporário e
+enviado ao Drive sem montar DataFrame, com memória constante.
 """
 
+import csv
+import glob
+import io
 import os
 import logging
-from typing import Optional
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional
 
 import pandas as pd
 
 from config import load_config
-from drive_client import authenticate_google_drive, upload_or_update_bytes
+from drive_client import DriveUploader
+from metrics import RunMetrics
+from utils import OutputSpec, compressed_writer, output_spec, require_compressor
 
 try:
     import psycopg
@@ -35,6 +52,27 @@ except Exception:
             "psycopg (v3) or psycopg2 is required. Install with: pip install psycopg[binary] or psycopg2-binary"
         )
 
+# Pool de conexões: psycopg_pool no psycopg3 (dependência do projeto), psycopg2.pool no psycopg2
+try:
+    if _PSYCOPG_V3:
+        from psycopg_pool import ConnectionPool
+    else:
+        from psycopg2.pool import ThreadedConnectionPool
+except Exception:
+    ConnectionPool = None
+    ThreadedConnectionPool = None
+
+
+# Até este tamanho o CSV exportado fica em memória; acima disso vai para disco
+_SPOOL_MAX_BYTES = 32 * 1024 * 1024
+_EXPORT_MODES = ("dataframe", "copy", "cursor")
+
+# Lista usada quando database.queries e database.sql_dir não estão configurados
+_DEFAULT_QUERIES = [
+    {"sql_file": os.path.join("sql", "base_status_pedidos_wms_sae.sql"), "output_csv": "pce.csv"},
+    {"sql_file": os.path.join("sql", "produtividade_sae.sql"), "output_csv": "produtividade_sae.csv"},
+]
+
 
 # --------------------------------------------------------------------------
 # Funções utilitárias
@@ -47,11 +85,8 @@ def _read_sql_file(path: str) -> list[str]:
     return [stmt.strip() for stmt in content.split(";") if stmt.strip()]
 
 
-def _connect() -> object:
-    """Retorna conexão com Postgres usando psycopg3 ou psycopg2."""
-    cfg = load_config()
-    db_cfg = cfg.get("database", {}) if isinstance(cfg, dict) else {}
-
+def _connection_params(db_cfg: dict) -> Dict[str, Any]:
+    """Parâmetros de conexão a partir de database (config.json) ou das variáveis PG*."""
     host = db_cfg.get("host") or os.getenv("PGHOST", "localhost")
     port = db_cfg.get("port") or os.getenv("PGPORT", "5432")
     user = db_cfg.get("user") or os.getenv("PGUSER", os.getenv("USER", ""))
@@ -63,14 +98,102 @@ def _connect() -> object:
     except Exception:
         port_int = port
 
+    return {"host": host, "port": port_int, "user": user, "password": password, "dbname": dbname}
+
+
+def _connect(db_cfg: dict) -> object:
+    """Retorna conexão com Postgres usando psycopg3 ou psycopg2."""
+    params = _connection_params(db_cfg)
     if _PSYCOPG_V3:
-        return psycopg.connect(host=host, port=port_int, user=user, password=password, dbname=dbname)
+        return psycopg.connect(**params)
     else:
-        return psycopg2.connect(host=host, port=port_int, user=user, password=password, dbname=dbname)
+        return psycopg2.connect(**params)
 
 
-def _run_query_to_dataframe(conn, sql_path: str) -> pd.DataFrame:
-    """Executa a query SQL e retorna um DataFrame."""
+def _open_pool(db_cfg: dict, size: int) -> Optional[object]:
+    """Pool com até `size` conexões; None quando nenhuma biblioteca de pool está disponível."""
+    params = _connection_params(db_cfg)
+    if _PSYCOPG_V3 and ConnectionPool is not None:
+        return ConnectionPool(kwargs=params, min_size=1, max_size=size, open=True)
+    if not _PSYCOPG_V3 and ThreadedConnectionPool is not None:
+        return ThreadedConnectionPool(1, size, **params)
+    logging.warning("Pool de conexões indisponível (pip install psycopg-pool); uma conexão por query")
+    return None
+
+
+def _close_pool(pool: Optional[object]) -> None:
+    if pool is None:
+        return
+    if _PSYCOPG_V3:
+        pool.close()
+    else:
+        pool.closeall()
+
+
+@contextmanager
+def _borrow(pool: Optional[object], db_cfg: dict) -> Iterator[object]:
+    """Empresta uma conexão do pool (ou abre uma avulsa) pelo tempo de uma query."""
+    if pool is None:
+        conn = _connect(db_cfg)
+        try:
+            yield conn
+        finally:
+            conn.close()
+    elif _PSYCOPG_V3:
+        with pool.connection() as conn:
+            yield conn
+    else:
+        conn = pool.getconn()
+        try:
+            yield conn
+        finally:
+            pool.putconn(conn)
+
+
+def _resolve_queries(db_cfg: dict, base_dir: str) -> List[Dict[str, Any]]:
+    """Monta a lista de queries: database.queries e/ou os .sql de database.sql_dir.
+
+    Entradas de database.queries podem ser {"sql_file", "output_csv", "compression"} ou só o
+    caminho do .sql (o CSV leva o nome do arquivo). Arquivos listados explicitamente não são
+    repetidos pelo scan. `compression` (gzip/zstd) ou um nome .csv.gz/.csv.zst comprime o CSV.
+    """
+    entries = db_cfg.get("queries")
+    sql_dir = db_cfg.get("sql_dir")
+    if entries is None and not sql_dir:
+        entries = _DEFAULT_QUERIES
+
+    def absolute(path: str) -> str:
+        return path if os.path.isabs(path) else os.path.join(base_dir, path)
+
+    def default_name(path: str) -> str:
+        return os.path.splitext(os.path.basename(path))[0] + ".csv"
+
+    def query(sql_file: str, output: Dict[str, Any]) -> Dict[str, Any]:
+        spec = output_spec(output, default_name(sql_file))
+        if spec.format != "csv":
+            raise ValueError(f"main_db exporta apenas CSV (com ou sem gzip/zstd): {spec.file_name}")
+        # zstd sem a biblioteca falha aqui, antes de qualquer query rodar
+        require_compressor(spec.compression)
+        return {"sql_file": sql_file, "output_csv": spec.file_name, "spec": spec}
+
+    queries: List[Dict[str, Any]] = []
+    for entry in entries or []:
+        if isinstance(entry, str):
+            entry = {"sql_file": entry}
+        output = {"file": entry.get("output_csv"), "compression": entry.get("compression")}
+        queries.append(query(absolute(entry["sql_file"]), output))
+
+    if sql_dir:
+        listed = {os.path.normpath(q["sql_file"]) for q in queries}
+        compression = db_cfg.get("compression")
+        for sql_file in sorted(glob.glob(os.path.join(absolute(sql_dir), "*.sql"))):
+            if os.path.normpath(sql_file) not in listed:
+                queries.append(query(sql_file, {"compression": compression}))
+    return queries
+
+
+def _prepare_query(conn, sql_path: str) -> str:
+    """Executa os statements intermediários do arquivo e devolve o SELECT final."""
     if not os.path.exists(sql_path):
         raise FileNotFoundError(f"Arquivo SQL não encontrado: {sql_path}")
 
@@ -87,7 +210,12 @@ def _run_query_to_dataframe(conn, sql_path: str) -> pd.DataFrame:
                 cur.execute(stmt)
                 conn.commit()
 
-    select_query = statements[-1]
+    return statements[-1]
+
+
+def _run_query_to_dataframe(conn, sql_path: str) -> pd.DataFrame:
+    """Executa a query SQL e retorna um DataFrame."""
+    select_query = _prepare_query(conn, sql_path)
     if _PSYCOPG_V3:
         with conn.cursor(row_factory=psycopg.rows.dict_row) as cur:
             cur.execute(select_query)
@@ -105,73 +233,222 @@ def _run_query_to_dataframe(conn, sql_path: str) -> pd.DataFrame:
     return df
 
 
-def _upload_dataframe_to_drive(df: pd.DataFrame, drive_cfg: dict, file_name: str):
-    """Envia um DataFrame ao Google Drive."""
-    base_dir = os.path.dirname(__file__)
-    client_secret_path = os.path.join(base_dir, drive_cfg["client_secret_file"])
-    token_path = os.path.join(base_dir, drive_cfg.get("token_file", "token.json"))
+def _copy_query_to_file(conn, sql_path: str, fileobj: BinaryIO) -> None:
+    """Grava o resultado da query como CSV (com cabeçalho) via COPY ... TO STDOUT, em chunks."""
+    select_query = _prepare_query(conn, sql_path)
+    # Quebra de linha antes do ")": um "-- comentário" no fim do .sql não pode engolir o parêntese
+    copy_sql = f"COPY ({select_query}\n) TO STDOUT WITH (FORMAT CSV, HEADER)"
+    with conn.cursor() as cur:
+        if _PSYCOPG_V3:
+            with cur.copy(copy_sql) as copy:
+                for chunk in copy:
+                    fileobj.write(chunk)
+        else:
+            cur.copy_expert(copy_sql, fileobj)
+
+
+def _cursor_query_to_file(conn, sql_path: str, fileobj: BinaryIO, batch_rows: int = 10000) -> None:
+    """Grava o resultado da query como CSV lendo um cursor nomeado (server-side) em lotes."""
+    select_query = _prepare_query(conn, sql_path)
+    text = io.TextIOWrapper(fileobj, encoding="utf-8", newline="", write_through=True)
+    writer = csv.writer(text, lineterminator="\n")
+    try:
+        with conn.cursor(name="main_db_export") as cur:
+            cur.itersize = batch_rows
+            cur.execute(select_query)
+            rows = cur.fetchmany(batch_rows)
+            # No psycopg2 a descrição do cursor nomeado só existe após o primeiro fetch
+            writer.writerow([col[0] for col in cur.description])
+            while rows:
+                writer.writerows(rows)
+                rows = cur.fetchmany(batch_rows)
+        conn.commit()
+    finally:
+        text.detach()
 
-    service = authenticate_google_drive(
-        client_secret_file=client_secret_path,
-        scopes=drive_cfg.get("scopes", ["https://www.googleapis.com/auth/drive"]),
-        token_file=token_path,
-    )
 
-    folder_id = drive_cfg["folder_id"]
-    shared_drive_id = drive_cfg.get("shared_drive_id")
+def _export_query_to_file(
+    conn,
+    sql_path: str,
+    mode: str,
+    batch_rows: int,
+    compression: Optional[str] = None,
+) -> BinaryIO:
+    """Exporta a query em streaming para um SpooledTemporaryFile (memória constante).
 
-    csv_bytes = df.to_csv(index=False, sep=",").encode("utf-8")
+    Com `compression` (gzip/zstd), os chunks são comprimidos à medida que chegam.
+    """
+    fileobj = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_BYTES)
+    try:
+        with compressed_writer(fileobj, compression) as out:
+            if mode == "copy":
+                _copy_query_to_file(conn, sql_path, out)
+            else:
+                _cursor_query_to_file(conn, sql_path, out, batch_rows=batch_rows)
+    except Exception:
+        fileobj.close()
+        raise
+    size = fileobj.tell()
+    if size == 0:
+        logging.warning("A query em %s não retornou resultados.", sql_path)
+    logging.info("Exportado %s (%.1f MB, modo %s, compressão %s)", sql_path, size / 1024 / 1024, mode, compression or "nenhuma")
+    fileobj.seek(0)
+    return fileobj
 
-    logging.info("Fazendo upload de %s para o Google Drive...", file_name)
-    upload_or_update_bytes(
-        service=service,
-        folder_id=folder_id,
-        shared_drive_id=shared_drive_id,
-        file_name=file_name,
-        content_bytes=csv_bytes,
-        mime_type="text/csv",
-    )
-    logging.info("Upload concluído: %s", file_name)
+
+def _upload_file_to_drive(fileobj: BinaryIO, uploader: DriveUploader, spec: OutputSpec):
+    """Envia ao Google Drive um CSV já gravado em arquivo, sem carregá-lo inteiro em memória."""
+    logging.info("Fazendo upload de %s para o Google Drive...", spec.file_name)
+    result = uploader.upload_fileobj(spec.file_name, fileobj, mime_type=spec.mime_type)
+    if not result.skipped:
+        logging.info("Upload concluído: %s", spec.file_name)
+
+
+def _upload_dataframe_to_drive(df: pd.DataFrame, uploader: DriveUploader, spec: OutputSpec):
+    """Envia um DataFrame ao Google Drive."""
+    # O CSV vai direto para o arquivo temporário, sem uma cópia completa em bytes na memória
+    with tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_BYTES) as fileobj:
+        with compressed_writer(fileobj, spec.compression) as out:
+            text = io.TextIOWrapper(out, encoding="utf-8", newline="", write_through=True)
+            try:
+                df.to_csv(text, index=False, sep=",")
+            finally:
+                text.detach()
+        _upload_file_to_drive(fileobj, uploader, spec)
 
 
 # --------------------------------------------------------------------------
 # Execução principal
 # --------------------------------------------------------------------------
 
-def main() -> None:
-    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
-    cfg = load_config()
+def _run_export(
+    q: Dict[str, Any],
+    pool: Optional[object],
+    uploader: DriveUploader,
+    db_cfg: dict,
+    export_mode: str,
+    batch_rows: int,
+    metrics: RunMetrics,
+) -> float:
+    """Executa uma query e envia o CSV ao Drive; devolve a duração em segundos."""
+    started = time.perf_counter()
+    sql_path = q["sql_file"]
+    spec = q["spec"]
+    logging.info("Executando extração para %s", spec.file_name)
+    if export_mode != "dataframe":
+        with metrics.stage("query"), _borrow(pool, db_cfg) as conn:
+            fileobj = _export_query_to_file(conn, sql_path, export_mode, batch_rows, compression=spec.compression)
+        # A conexão volta ao pool antes do upload, liberando-a para a próxima query
+        with fileobj, metrics.stage("upload"):
+            _upload_file_to_drive(fileobj, uploader, spec)
+    else:
+        with metrics.stage("query"), _borrow(pool, db_cfg) as conn:
+            df = _run_query_to_dataframe(conn, sql_path)
+        if df is not None:
+            with metrics.stage("upload"):
+                _upload_dataframe_to_drive(df, uploader, spec)
+    return time.perf_counter() - started
 
-    base_dir = os.path.dirname(__file__)
-    conn = _connect()
 
-    try:
-        queries = [
-            {
-                "sql_file": os.path.join(base_dir, "sql", "base_status_pedidos_wms_sae.sql"),
-                "output_csv": "pce.csv",
-            },
-            {
-                "sql_file": os.path.join(base_dir, "sql", "produtividade_sae.sql"),
-                "output_csv": "produtividade_sae.csv",
-            },
-        ]
-
-        for q in queries:
-            sql_path = q["sql_file"]
-            csv_name = q["output_csv"]
-            logging.info("Executando extração para %s", csv_name)
-            df = _run_query_to_dataframe(conn, sql_path)
-            if df is not None:
-                _upload_dataframe_to_drive(df, cfg["drive"], csv_name)
+def open_pool(cfg: dict) -> Optional[object]:
+    """Pool de longa duração para o modo serviço (scheduler.py), reaproveitado entre execuções."""
+    db_cfg = cfg.get("database", {}) if isinstance(cfg, dict) else {}
+    return _open_pool(db_cfg, max(1, int(db_cfg.get("parallelism", 4))))
+
+
+def close_pool(pool: Optional[object]) -> None:
+    _close_pool(pool)
 
-        logging.info("✅ Todas as consultas foram executadas e enviadas com sucesso para o Drive.")
 
+def main(
+    cfg: Optional[dict] = None,
+    uploader: Optional[DriveUploader] = None,
+    pool: Optional[object] = None,
+) -> RunMetrics:
+    """Executa as queries uma vez e devolve as métricas da execução.
+
+    O modo serviço (scheduler.py) passa o uploader já autenticado e um pool já aberto (open_pool),
+    que continuam abertos ao final.
+    """
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    cfg = cfg if cfg is not None else load_config()
+
+    base_dir = os.path.dirname(__file__)
+    # Relatório da execução (JSON em metrics.report_dir e, opcional, textfile do Prometheus)
+    metrics = RunMetrics.from_config(cfg, base_dir, pipeline="main_db")
+    error: Optional[BaseException] = None
+    try:
+        _main(cfg, base_dir, metrics, uploader, pool)
+    except BaseException as exc:
+        error = exc
+        raise
     finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
+        metrics.finish(error)
+        metrics.log_summary()
+        path = metrics.write_report()
+        if path:
+            logging.info("Relatório da execução gravado em %s", path)
+    return metrics
+
+
+def _main(
+    cfg: dict,
+    base_dir: str,
+    metrics: RunMetrics,
+    uploader: Optional[DriveUploader],
+    pool: Optional[object],
+) -> None:
+    db_cfg = cfg.get("database", {}) if isinstance(cfg, dict) else {}
+    export_mode = db_cfg.get("export_mode", "dataframe")
+    if export_mode not in _EXPORT_MODES:
+        raise ValueError(f"database.export_mode inválido: {export_mode} (use {', '.join(_EXPORT_MODES)})")
+    batch_rows = int(db_cfg.get("batch_rows", 10000))
+
+    queries = _resolve_queries(db_cfg, base_dir)
+    if not queries:
+        logging.warning("Nenhuma query configurada em database.queries/database.sql_dir.")
+        return
+    parallelism = max(1, min(int(db_cfg.get("parallelism", 4)), len(queries)))
+    # Uma autenticação e uma listagem da pasta do Drive para o lote inteiro
+    if uploader is None:
+        uploader = DriveUploader.from_config(cfg["drive"], base_dir, metrics=metrics)
+    else:
+        uploader.metrics = metrics
+        uploader.refresh()
+    # Pool recebido do modo serviço continua aberto; o criado aqui é fechado ao final
+    owns_pool = pool is None
+    if owns_pool:
+        pool = _open_pool(db_cfg, parallelism)
+
+    started = time.perf_counter()
+    failures: List[str] = []
+    try:
+        with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="main_db") as executor:
+            futures = {
+                executor.submit(_run_export, q, pool, uploader, db_cfg, export_mode, batch_rows, metrics): q["output_csv"]
+                for q in queries
+            }
+            for future in as_completed(futures):
+                csv_name = futures[future]
+                try:
+                    elapsed = future.result()
+                    logging.info("%s concluído em %.1fs", csv_name, elapsed)
+                except Exception:
+                    logging.exception("Falha ao exportar %s", csv_name)
+                    failures.append(csv_name)
+    finally:
+        if owns_pool:
+            _close_pool(pool)
+
+    wall = time.perf_counter() - started
+    if failures:
+        raise RuntimeError(f"Falha em {len(failures)} de {len(queries)} consultas: {', '.join(sorted(failures))}")
+    logging.info(
+        "✅ Todas as consultas foram executadas e enviadas com sucesso para o Drive (%s consultas, %.1fs, paralelismo %s).",
+        len(queries),
+        wall,
+        parallelism,
+    )
 
 
 if __name__ == "__main__":
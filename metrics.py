@@ -0,0 +1,347 @@
+import bisect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import resource
+except Exception:
+    resource = None
+
+try:
+    import psutil
+except Exception:
+    psutil = None
+
+# Limites (segundos) do histograma de latência das requisições ao WMS
+LATENCY_BUCKETS: Tuple[float, ...] = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Pico de memória residente do processo desde que ele iniciou (None se a plataforma não informar).
+
+    O contador do sistema não é zerado entre execuções: no modo serviço (scheduler.py) o valor
+    é o maior pico entre todas as execuções já feitas pelo processo, não o desta execução.
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux informa em KiB; macOS em bytes
+        return int(peak if sys.platform == "darwin" else peak * 1024)
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return int(getattr(info, "peak_wset", info.rss))
+    return None
+
+
+class Histogram:
+    """Histograma cumulativo no formato do Prometheus (contagem por limite superior `le`)."""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        total = 0
+        out = []
+        for le, n in zip([*map(str, self.buckets), "+Inf"], self.counts):
+            total += n
+            out.append((le, total))
+        return out
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"buckets": dict(self.cumulative()), "sum": round(self.sum, 6), "count": self.count}
+
+
+class EntityMetrics:
+    """Contadores da extração de uma entidade do WMS."""
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.server_errors = 0
+        self.network_errors = 0
+        self.pages = 0
+        self.failed_pages = 0
+        self.resumed_pages = 0
+        self.rows = 0
+        self.bytes = 0
+        self.decoded_pages = 0
+        self.decode_seconds = 0.0
+        self.decode_max_seconds = 0.0
+        self.latency = Histogram()
+
+    def observe_decode(self, size: int, seconds: float) -> None:
+        self.decoded_pages += 1
+        self.bytes += size
+        self.decode_seconds += seconds
+        self.decode_max_seconds = max(self.decode_max_seconds, seconds)
+
+    def as_dict(self) -> Dict[str, Any]:
+        data = {key: value for key, value in vars(self).items() if key != "latency"}
+        data["decode_seconds"] = round(self.decode_seconds, 4)
+        data["decode_max_seconds"] = round(self.decode_max_seconds, 4)
+        data["latency_seconds"] = self.latency.as_dict()
+        return data
+
+
+class RunMetrics:
+    """Métricas de uma execução: entidades do WMS, duração das etapas, uploads e pico de memória do processo.
+
+    `stage()` acumula segundos por etapa (somados entre threads, quando há paralelismo). Ao final,
+    `write_report()` grava o relatório JSON e, se configurado, o textfile do Prometheus
+    (node_exporter --collector.textfile.directory).
+    """
+
+    def __init__(self, pipeline: str = "main") -> None:
+        self.pipeline = pipeline
+        self.started_at = datetime.now()
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.entities: Dict[str, EntityMetrics] = {}
+        self.stages: Dict[str, float] = {}
+        self.uploads: Dict[str, Dict[str, Any]] = {}
+        self.status = "running"
+        self.error: Optional[str] = None
+        self.duration = 0.0
+        self.process_peak_rss: Optional[int] = None
+        # Destinos do relatório (from_config); sem eles, write_report() não grava nada
+        self.report_dir: Optional[str] = None
+        self.keep_reports = 50
+        self.textfile: Optional[str] = None
+
+    @classmethod
+    def from_config(cls, cfg: Dict[str, Any], base_dir: str, pipeline: str = "main") -> "RunMetrics":
+        metrics = cls(pipeline)
+        metrics_cfg = cfg.get("metrics") or {}
+
+        def absolute(path: Optional[str]) -> Optional[str]:
+            if not path:
+                return None
+            return path if os.path.isabs(path) else os.path.join(base_dir, path)
+
+        metrics.report_dir = absolute(metrics_cfg.get("report_dir", os.path.join("state", "reports")))
+        metrics.keep_reports = int(metrics_cfg.get("keep_reports", 50))
+        textfile = absolute(metrics_cfg.get("prometheus_textfile"))
+        if textfile:
+            # Um arquivo por pipeline (arco_main.prom, arco_main_db.prom): main.py e main_db.py não se sobrescrevem
+            root, ext = os.path.splitext(textfile)
+            metrics.textfile = f"{root}_{pipeline}{ext or '.prom'}"
+        return metrics
+
+    def entity(self, name: str) -> EntityMetrics:
+        metrics = self.entities.get(name)
+        if metrics is None:
+            metrics = self.entities[name] = EntityMetrics()
+        return metrics
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - started)
+
+    def record_upload(self, file_name: str, result: str, size: int = 0, seconds: float = 0.0) -> None:
+        """`result`: "sent", "skipped" (conteúdo igual ao do Drive) ou "failed"."""
+        with self._lock:
+            self.uploads[file_name] = {"result": result, "bytes": size, "seconds": round(seconds, 3)}
+
+    @property
+    def failed_pages(self) -> int:
+        return sum(m.failed_pages for m in self.entities.values())
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        if error is not None:
+            self.status = "failed"
+            self.error = f"{type(error).__name__}: {error}"
+        elif self.failed_pages or any(u["result"] == "failed" for u in self.uploads.values()):
+            # Terminou, mas com páginas perdidas ou uploads falhos: não é uma execução saudável
+            self.status = "degraded"
+        else:
+            self.status = "ok"
+        self.duration = time.perf_counter() - self._started
+        self.process_peak_rss = peak_rss_bytes()
+
+    def report(self) -> Dict[str, Any]:
+        uploads = list(self.uploads.values())
+        return {
+            "pipeline": self.pipeline,
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "status": self.status,
+            "error": self.error,
+            "duration_seconds": round(self.duration, 3),
+            "process_peak_rss_bytes": self.process_peak_rss,
+            "stages_seconds": {name: round(seconds, 3) for name, seconds in self.stages.items()},
+            "entities": {name: m.as_dict() for name, m in self.entities.items()},
+            "uploads": {
+                "sent": sum(1 for u in uploads if u["result"] == "sent"),
+                "skipped": sum(1 for u in uploads if u["result"] == "skipped"),
+                "failed": sum(1 for u in uploads if u["result"] == "failed"),
+                "bytes_sent": sum(u["bytes"] for u in uploads if u["result"] == "sent"),
+                "files": self.uploads,
+            },
+        }
+
+    def prometheus(self) -> str:
+        lines: List[str] = []
+        base = {"pipeline": self.pipeline}
+
+        def metric(name: str, kind: str, help_text: str, samples: List[Tuple[Dict[str, str], float]]) -> None:
+            lines.append(f"# HELP arco_{name} {help_text}")
+            lines.append(f"# TYPE arco_{name} {kind}")
+            for labels, value in samples:
+                rendered = ",".join(f'{k}="{v}"' for k, v in {**base, **labels}.items())
+                lines.append(f"arco_{name}{{{rendered}}} {value}")
+
+        entities = sorted(self.entities.items())
+        metric("run_timestamp_seconds", "gauge", "Início da última execução (epoch).", [({}, round(self.started_at.timestamp(), 3))])
+        metric("run_success", "gauge", "1 se a última execução terminou sem erro nem perdas.", [({}, int(self.status == "ok"))])
+        metric("run_duration_seconds", "gauge", "Duração da última execução.", [({}, round(self.duration, 3))])
+        if self.process_peak_rss is not None:
+            metric(
+                "process_peak_rss_bytes",
+                "gauge",
+                "Pico de memória residente do processo desde o início (acumula entre execuções do serviço).",
+                [({}, self.process_peak_rss)],
+            )
+        metric(
+            "stage_duration_seconds",
+            "gauge",
+            "Segundos por etapa (somados entre threads).",
+            [({"stage": name}, round(seconds, 3)) for name, seconds in sorted(self.stages.items())],
+        )
+        for field, help_text in (
+            ("pages", "Páginas recebidas do WMS."),
+            ("failed_pages", "Páginas perdidas após esgotar as tentativas."),
+            ("resumed_pages", "Páginas relidas do checkpoint."),
+            ("rows", "Registros recebidos do WMS."),
+            ("bytes", "Bytes de JSON recebidos do WMS."),
+            ("requests", "Requisições feitas ao WMS."),
+            ("retries", "Retentativas de requisição ao WMS."),
+            ("throttled", "Respostas 429 do WMS."),
+            ("server_errors", "Respostas 5xx do WMS."),
+        ):
+            metric(f"wms_{field}", "gauge", help_text, [({"entity": name}, getattr(m, field)) for name, m in entities])
+        metric(
+            "wms_rows_per_second",
+            "gauge",
+            "Registros por segundo de extração.",
+            [({"entity": name}, round(m.rows / self.stages["extract"], 1)) for name, m in entities if self.stages.get("extract")],
+        )
+
+        lines.append("# HELP arco_wms_request_duration_seconds Latência das requisições ao WMS.")
+        lines.append("# TYPE arco_wms_request_duration_seconds histogram")
+        for name, m in entities:
+            labels = f'pipeline="{self.pipeline}",entity="{name}"'
+            for le, count in m.latency.cumulative():
+                lines.append(f'arco_wms_request_duration_seconds_bucket{{{labels},le="{le}"}} {count}')
+            lines.append(f"arco_wms_request_duration_seconds_sum{{{labels}}} {round(m.latency.sum, 6)}")
+            lines.append(f"arco_wms_request_duration_seconds_count{{{labels}}} {m.latency.count}")
+
+        uploads = self.report()["uploads"]
+        metric(
+            "drive_uploads",
+            "gauge",
+            "Arquivos por resultado do upload ao Drive.",
+            [({"result": result}, uploads[result]) for result in ("sent", "skipped", "failed")],
+        )
+        metric("drive_upload_bytes", "gauge", "Bytes enviados ao Drive.", [({}, uploads["bytes_sent"])])
+        return "\n".join(lines) + "\n"
+
+    def write_report(self) -> Optional[str]:
+        """Grava o relatório JSON (e o textfile do Prometheus); devolve o caminho do JSON."""
+        path = None
+        if self.report_dir:
+            os.makedirs(self.report_dir, exist_ok=True)
+            name = f"{self.pipeline}_{self.started_at.strftime('%Y%m%dT%H%M%S')}.json"
+            path = os.path.join(self.report_dir, name)
+            _write_atomic(path, json.dumps(self.report(), indent=2, ensure_ascii=False))
+            self._prune_reports()
+        if self.textfile:
+            os.makedirs(os.path.dirname(self.textfile) or ".", exist_ok=True)
+            # O coletor textfile lê o diretório a qualquer momento: grava em .tmp e renomeia
+            _write_atomic(self.textfile, self.prometheus())
+        return path
+
+    def _prune_reports(self) -> None:
+        # main_<data>.json não deve casar com main_db_<data>.json
+        prefix = f"{self.pipeline}_"
+        reports = sorted(
+            n for n in os.listdir(self.report_dir)
+            if n.startswith(prefix) and n[len(prefix):][:1].isdigit() and n.endswith(".json")
+        )
+        for name in reports[: max(0, len(reports) - self.keep_reports)]:
+            os.remove(os.path.join(self.report_dir, name))
+
+    def log_summary(self) -> None:
+        for name, m in sorted(self.entities.items()):
+            level = logging.WARNING if m.failed_pages else logging.INFO
+            logging.log(
+                level,
+                "Métricas %s: %s páginas (%s falharam, %s do checkpoint), %s linhas, %.1f MB, %s retentativas, "
+                "%s respostas 429, decodificação %.2fs",
+                name,
+                m.pages,
+                m.failed_pages,
+                m.resumed_pages,
+                m.rows,
+                m.bytes / (1024 * 1024),
+                m.retries,
+                m.throttled,
+                m.decode_seconds,
+            )
+        stages = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in self.stages.items())
+        peak = f"{self.process_peak_rss / (1024 * 1024):.0f} MB" if self.process_peak_rss else "n/d"
+        logging.info(
+            "Execução %s: %s em %.1fs (%s); pico de memória do processo %s",
+            self.pipeline,
+            self.status,
+            self.duration,
+            stages,
+            peak,
+        )
+
+
+def _write_atomic(path: str, content: str) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+class TimedSink:
+    """Envolve um sink medindo a normalização das linhas e a carga no destino como etapas separadas."""
+
+    def __init__(self, sink: Any, metrics: RunMetrics, load_stage: str = "load") -> None:
+        self.sink = sink
+        self.metrics = metrics
+        self.load_stage = load_stage
+
+    def write_rows(self, rows: Iterable[Sequence[Any]]) -> None:
+        with self.metrics.stage("normalize"):
+            rows = list(rows)
+        with self.metrics.stage(self.load_stage):
+            self.sink.write_rows(rows)
+
+    def close(self) -> None:
+        with self.metrics.stage(self.load_stage):
+            self.sink.close()
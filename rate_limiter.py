@@ -0,0 +1,128 @@
+import asyncio
+import contextlib
+import logging
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Optional
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Converte o header Retry-After (segundos ou data HTTP) em segundos de espera."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class AdaptiveLimiter:
+    """Limite AIMD de requisições em voo.
+
+    Cresce +1 a cada `limit` respostas saudáveis seguidas e cai para `limit * decrease_factor`
+    em 429/5xx/timeouts ou quando a latência recente passa de `latency_tolerance` vezes a
+    latência de referência. Com min_limit == max_limit funciona como um semáforo fixo.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int = 1,
+        max_limit: Optional[int] = None,
+        decrease_factor: float = 0.5,
+        latency_tolerance: float = 2.0,
+    ) -> None:
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit if max_limit is not None else initial)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+
+        self._in_flight = 0
+        self._successes = 0
+        self._fast_latency: Optional[float] = None
+        self._slow_latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self._paused_until = 0.0
+        self._cond = asyncio.Condition()
+
+    @property
+    def adaptive(self) -> bool:
+        return self.min_limit != self.max_limit
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def acquire(self) -> None:
+        while True:
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            async with self._cond:
+                if self._in_flight < int(self.limit):
+                    self._in_flight += 1
+                    return
+                await self._cond.wait()
+
+    async def release(self) -> None:
+        async with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        await self.acquire()
+        try:
+            yield
+        finally:
+            await self.release()
+
+    def on_success(self, latency: float) -> None:
+        if not self.adaptive:
+            return
+        # EWMA rápida (recente) contra EWMA lenta (referência) para detectar latência subindo
+        if self._fast_latency is None:
+            self._fast_latency = self._slow_latency = latency
+        else:
+            self._fast_latency += 0.2 * (latency - self._fast_latency)
+            self._slow_latency += 0.02 * (latency - self._slow_latency)
+
+        if self._fast_latency > self._slow_latency * self.latency_tolerance:
+            self._decrease("latência subindo (%.2fs vs %.2fs)" % (self._fast_latency, self._slow_latency))
+            return
+
+        self._successes += 1
+        if self._successes >= int(self.limit) and self.limit < self.max_limit:
+            self._successes = 0
+            # Quem espera é acordado no release() que segue esta resposta
+            self.limit = min(self.max_limit, self.limit + 1)
+
+    def on_overload(self, retry_after: Optional[float] = None, reason: str = "sobrecarga") -> None:
+        if retry_after:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        if self.adaptive:
+            self._decrease(reason)
+
+    def _decrease(self, reason: str) -> None:
+        now = time.monotonic()
+        # Vários erros da mesma rajada contam como um só corte
+        window = max(self._fast_latency or 0.0, 1.0)
+        if now - self._last_decrease < window:
+            return
+        self._last_decrease = now
+        self._successes = 0
+        new_limit = max(float(self.min_limit), self.limit * self.decrease_factor)
+        if int(new_limit) != int(self.limit):
+            logging.info("Concorrência WMS reduzida de %s para %s (%s)", int(self.limit), int(new_limit), reason)
+        self.limit = new_limit
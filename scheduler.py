@@ -0,0 +1,328 @@
+"""Modo serviço: roda os jobs de main.py e main_db.py em intervalos ou expressões cron num só processo.
+
+Cliente WMS (sessão aiohttp e limitador), uploaders do Drive (credenciais e discovery) e o pool do
+Postgres são criados uma vez e reaproveitados em todas as execuções. Um job cujo pipeline ainda está
+rodando é pulado, e o estado das últimas execuções fica em GET /health (por padrão em 127.0.0.1:8787).
+
+    python scheduler.py
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Set, Tuple
+
+from aiohttp import web
+
+import main
+from config import load_config
+from drive_client import DriveUploader
+
+_PIPELINES = ("main", "main_db")
+
+
+class CronSchedule:
+    """Expressão cron de 5 campos (minuto hora dia mês dia-da-semana), no horário local.
+
+    Cada campo aceita `*`, `*/n`, `a`, `a-b`, `a-b/n` e listas separadas por vírgula; no dia da
+    semana, 0 e 7 são domingo. Como no cron, se dia e dia-da-semana forem restritos, basta um casar.
+    """
+
+    _RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression: str) -> None:
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Expressão cron inválida (5 campos): {expression!r}")
+        self.expression = expression
+        parsed = [self._parse(field, low, high, expression) for field, (low, high) in zip(fields, self._RANGES)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = {0 if d == 7 else d for d in weekdays}
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse(field: str, low: int, high: int, expression: str) -> Set[int]:
+        values: Set[int] = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step_text = part.split("/", 1)
+                step = int(step_text)
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start, end = (int(v) for v in part.split("-", 1))
+            else:
+                start = end = int(part)
+                if step > 1:
+                    end = high
+            if step < 1 or start < low or end > high or start > end:
+                raise ValueError(f"Expressão cron inválida: {expression!r} (campo {field!r})")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, dt: datetime) -> bool:
+        in_days = dt.day in self.days
+        in_weekdays = (dt.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+
+    def next_after(self, after: datetime) -> datetime:
+        dt = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=366 * 5)
+        while dt < limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return dt
+        raise ValueError(f"Expressão cron sem próxima ocorrência: {self.expression!r}")
+
+    def __str__(self) -> str:
+        return f"cron {self.expression}"
+
+
+class IntervalSchedule:
+    def __init__(self, minutes: float) -> None:
+        if minutes <= 0:
+            raise ValueError(f"interval_minutes deve ser positivo: {minutes}")
+        self.interval = timedelta(minutes=minutes)
+
+    def next_after(self, after: datetime) -> datetime:
+        return after + self.interval
+
+    def __str__(self) -> str:
+        return f"a cada {self.interval}"
+
+
+class Job:
+    """Um job do serviço: pipeline (`main` ou `main_db`), agenda e estado das últimas execuções."""
+
+    def __init__(self, job_cfg: Dict[str, Any]) -> None:
+        self.name = job_cfg.get("name") or job_cfg.get("target", "main")
+        self.target = job_cfg.get("target", "main")
+        if self.target not in _PIPELINES:
+            raise ValueError(f"Job {self.name}: target inválido {self.target!r} (use {', '.join(_PIPELINES)})")
+        if job_cfg.get("cron"):
+            self.schedule: Any = CronSchedule(job_cfg["cron"])
+        elif job_cfg.get("interval_minutes"):
+            self.schedule = IntervalSchedule(float(job_cfg["interval_minutes"]))
+        else:
+            raise ValueError(f"Job {self.name}: configure interval_minutes ou cron")
+        self.full_refresh = bool(job_cfg.get("full", False))
+
+        now = datetime.now()
+        run_at_start = job_cfg.get("run_at_start", isinstance(self.schedule, IntervalSchedule))
+        self.next_run = now if run_at_start else self.schedule.next_after(now)
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.degraded = 0
+        self.skipped = 0
+        self.last_status: Optional[str] = None
+        self.last_started: Optional[datetime] = None
+        self.last_finished: Optional[datetime] = None
+        self.last_duration: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def status(self) -> Dict[str, Any]:
+        def iso(dt: Optional[datetime]) -> Optional[str]:
+            return dt.isoformat(timespec="seconds") if dt else None
+
+        return {
+            "target": self.target,
+            "schedule": str(self.schedule),
+            "full_refresh": self.full_refresh,
+            "running": self.running,
+            "next_run": iso(self.next_run),
+            "runs": self.runs,
+            "failures": self.failures,
+            "degraded": self.degraded,
+            "skipped": self.skipped,
+            "last_status": self.last_status,
+            "last_started": iso(self.last_started),
+            "last_finished": iso(self.last_finished),
+            "last_duration_seconds": round(self.last_duration, 3) if self.last_duration is not None else None,
+            "last_error": self.last_error,
+        }
+
+
+class Service:
+    """Agenda os jobs e mantém os recursos caros abertos entre as execuções."""
+
+    def __init__(self, cfg: Dict[str, Any], base_dir: str) -> None:
+        service_cfg = cfg.get("service") or {}
+        self.cfg = cfg
+        self.base_dir = base_dir
+        self.host = service_cfg.get("host", "127.0.0.1")
+        self.port = int(service_cfg.get("port", 8787))
+        self.jobs = [Job(job_cfg) for job_cfg in service_cfg.get("jobs", [])]
+        if not self.jobs:
+            raise ValueError("Nenhum job configurado em service.jobs")
+        self.started_at = datetime.now()
+        # Um pipeline não roda duas vezes ao mesmo tempo (mesmo DuckDB, estado incremental e uploader)
+        self._busy: Dict[str, threading.Lock] = {target: threading.Lock() for target in _PIPELINES}
+        self._tasks: Set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional[Any] = None
+        self._uploaders: Dict[str, DriveUploader] = {}
+        self._pool: Optional[object] = None
+        self._main_db: Optional[Any] = None
+
+    async def _open_resources(self) -> None:
+        targets = {job.target for job in self.jobs}
+        if "main" in targets:
+            self._client = main.build_client(self.cfg["wms"])
+            await self._client.open()
+        for target in targets:
+            # Credenciais e discovery do Drive uma vez por pipeline; a listagem da pasta é refeita a cada execução
+            self._uploaders[target] = await asyncio.to_thread(DriveUploader.from_config, self.cfg["drive"], self.base_dir)
+        if "main_db" in targets:
+            import main_db
+
+            self._main_db = main_db
+            self._pool = await asyncio.to_thread(main_db.open_pool, self.cfg)
+
+    async def _close_resources(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+        if self._main_db is not None:
+            await asyncio.to_thread(self._main_db.close_pool, self._pool)
+
+    def _run_async(self, coro: Any) -> Any:
+        # Chamado da thread do job: a extração roda no loop do serviço, onde a sessão aiohttp vive
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def _execute(self, job: Job) -> Tuple[str, Optional[str]]:
+        if job.target == "main":
+            metrics = main.run(
+                full_refresh=job.full_refresh,
+                cfg=self.cfg,
+                client=self._client,
+                uploader=self._uploaders["main"],
+                run_async=self._run_async,
+            )
+        else:
+            metrics = self._main_db.main(cfg=self.cfg, uploader=self._uploaders["main_db"], pool=self._pool)
+        return metrics.status, metrics.error
+
+    async def _run_job(self, job: Job, lock: threading.Lock) -> None:
+        job.running = True
+        job.runs += 1
+        job.last_started = datetime.now()
+        started = time.perf_counter()
+        logging.info("Serviço: iniciando %s (%s)", job.name, job.target)
+        try:
+            job.last_status, job.last_error = await asyncio.to_thread(self._execute, job)
+        except Exception as exc:
+            logging.exception("Serviço: %s falhou", job.name)
+            job.last_status, job.last_error = "failed", f"{type(exc).__name__}: {exc}"
+        finally:
+            lock.release()
+            job.running = False
+            job.last_finished = datetime.now()
+            job.last_duration = time.perf_counter() - started
+        if job.last_status == "failed":
+            job.failures += 1
+        elif job.last_status == "degraded":
+            job.degraded += 1
+        logging.info(
+            "Serviço: %s terminou com status %s em %.1fs; próxima execução %s",
+            job.name,
+            job.last_status,
+            job.last_duration,
+            job.next_run.isoformat(timespec="seconds"),
+        )
+
+    def _dispatch(self, job: Job, now: datetime) -> None:
+        job.next_run = job.schedule.next_after(now)
+        lock = self._busy[job.target]
+        if not lock.acquire(blocking=False):
+            job.skipped += 1
+            logging.warning("Serviço: %s pulado, %s ainda está em execução", job.name, job.target)
+            return
+        task = asyncio.create_task(self._run_job(job, lock))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _health(self, request: web.Request) -> web.Response:
+        jobs = {job.name: job.status() for job in self.jobs}
+        statuses = {job.last_status for job in self.jobs}
+        # degraded (páginas ou uploads perdidos) também derruba o health: os dados entregues estão incompletos
+        if "failed" in statuses:
+            status = "failing"
+        elif "degraded" in statuses:
+            status = "degraded"
+        else:
+            status = "ok"
+        body = {
+            "status": status,
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "jobs": jobs,
+        }
+        return web.json_response(body, status=200 if status == "ok" else 503)
+
+    async def serve(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self._loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                # Windows: sem add_signal_handler; Ctrl+C chega como KeyboardInterrupt
+                pass
+
+        await self._open_resources()
+        app = web.Application()
+        app.router.add_get("/health", self._health)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, self.host, self.port).start()
+        logging.info("Serviço: %s jobs; health em http://%s:%s/health", len(self.jobs), self.host, self.port)
+        for job in self.jobs:
+            logging.info("Serviço: job %s (%s, %s), próxima execução %s", job.name, job.target, job.schedule, job.next_run)
+
+        try:
+            while not stop.is_set():
+                now = datetime.now()
+                for job in self.jobs:
+                    if job.next_run <= now:
+                        self._dispatch(job, now)
+                wake = min(job.next_run for job in self.jobs)
+                timeout = min(max((wake - datetime.now()).total_seconds(), 0.0), 30.0)
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if self._tasks:
+                logging.info("Serviço: aguardando %s job(s) em execução", len(self._tasks))
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+            await runner.cleanup()
+            await self._close_resources()
+            logging.info("Serviço encerrado")
+
+
+def run_service() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    service = Service(load_config(), os.path.dirname(__file__))
+    try:
+        asyncio.run(service.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    argparse.ArgumentParser(description="Modo serviço: jobs de main.py/main_db.py agendados (service.jobs)").parse_args()
+    run_service()
@@ -0,0 +1,75 @@
+from collections import namedtuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+_EMPTY: Dict[str, Any] = {}
+
+
+class EntitySchema:
+    """Lista declarativa de campos de uma entidade do WMS.
+
+    Cada campo é um caminho na resposta da API: "order_nbr" ou "facility_id.key" (um nível
+    de aninhamento), que vira a coluna "facility_id_key". A partir da lista são gerados os
+    nomes de coluna, os campos para o parâmetro `fields` da API, um tipo de registro compacto
+    (namedtuple) e uma função que monta a linha como tupla, sem dict intermediário.
+
+    `types` mapeia coluna -> tipo ("int", "float", "bool", "date", "timestamp"); as demais
+    colunas são "string". Os tipos só valem para as saídas colunares (Arrow/Parquet/DuckDB).
+    """
+
+    TYPES = ("string", "int", "float", "bool", "date", "timestamp")
+
+    def __init__(self, entity: str, fields: Sequence[str], types: Optional[Dict[str, str]] = None) -> None:
+        self.entity = entity
+        self.paths: Tuple[Tuple[str, ...], ...] = tuple(tuple(f.split(".")) for f in fields)
+        for path in self.paths:
+            if len(path) > 2 or not all(part.isidentifier() for part in path):
+                raise ValueError(f"Campo inválido no schema de {entity}: {'.'.join(path)}")
+        self.columns: Tuple[str, ...] = tuple("_".join(path) for path in self.paths)
+        self.types: Dict[str, str] = dict(types or {})
+        for col, type_name in self.types.items():
+            if col not in self.columns or type_name not in self.TYPES:
+                raise ValueError(f"Tipo inválido no schema de {entity}: {col}={type_name}")
+
+        api_fields: List[str] = []
+        for path in self.paths:
+            if path[0] not in api_fields:
+                api_fields.append(path[0])
+        self.api_fields: Tuple[str, ...] = tuple(api_fields)
+
+        self.record_type = namedtuple(f"{entity}_record", self.columns)
+        self.row = self._compile_row()
+
+    def _compile_row(self):
+        # Gera uma função dedicada: um .get por campo e um só lookup por objeto aninhado
+        lines = ["def row(rec):", "    get = rec.get"]
+        nested: Dict[str, str] = {}
+        for path in self.paths:
+            if len(path) == 2 and path[0] not in nested:
+                var = f"n{len(nested)}"
+                nested[path[0]] = var
+                lines.append(f"    {var} = get({path[0]!r}) or _EMPTY")
+        values = []
+        for path in self.paths:
+            if len(path) == 1:
+                values.append(f"get({path[0]!r})")
+            else:
+                values.append(f"{nested[path[0]]}.get({path[1]!r})")
+        lines.append("    return (" + ", ".join(values) + ",)")
+        namespace: Dict[str, Any] = {"_EMPTY": _EMPTY}
+        exec("\n".join(lines), namespace)
+        return namespace["row"]
+
+    def rows(self, records: Iterable[Dict[str, Any]]) -> Iterator[Tuple[Any, ...]]:
+        return map(self.row, records)
+
+    def record(self, rec: Dict[str, Any]):
+        return self.record_type._make(self.row(rec))
+
+    def to_dict(self, rec: Dict[str, Any]) -> Dict[str, Any]:
+        return dict(zip(self.columns, self.row(rec)))
+
+    def type_of(self, column: str) -> str:
+        return self.types.get(column, "string")
+
+    def index(self, column: str) -> int:
+        return self.columns.index(column)
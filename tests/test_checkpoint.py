@@ -0,0 +1,29 @@
+import os
+
+from checkpoint import RunCheckpoint
+
+
+def _pending(root, run_id):
+    checkpoint = RunCheckpoint(str(root), run_id)
+    checkpoint.begin("order_dtl", {})
+    checkpoint.set_page_count("order_dtl", 2)
+    checkpoint.finish("order_dtl")
+    return checkpoint
+
+
+def test_prune_keeps_recent_pending_runs_until_one_completes(tmp_path):
+    for run_id in ("20240101T000000", "20240102T000000", "20240103T000000"):
+        _pending(tmp_path, run_id)
+    latest = _pending(tmp_path, "20240104T000000")
+
+    assert latest.prune(keep=2) == ["20240101T000000", "20240102T000000"]
+    assert sorted(os.listdir(tmp_path)) == ["20240103T000000", "20240104T000000"]
+
+    complete = RunCheckpoint(str(tmp_path), "20240105T000000")
+    complete.begin("order_dtl", {})
+    complete.set_page_count("order_dtl", 1)
+    complete.save_page("order_dtl", 1, [{"id": 1}])
+    complete.finish("order_dtl")
+    complete.discard()
+    complete.prune(keep=2)
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,61 @@
+from incremental import IncrementalState
+
+FIELDS = ["id", "mod_ts", "ord_qty"]
+
+
+class _ListSink:
+    def __init__(self):
+        self.rows = []
+
+    def write_rows(self, rows):
+        self.rows.extend(rows)
+
+    def close(self):
+        pass
+
+
+def _rows(ids, day):
+    return [(str(i), f"2024-01-{day:02d}T00:00:{i:02d}+00:00", "1") for i in ids]
+
+
+def _load(state, rows, complete):
+    sink = state.snapshot_sink("order_dtl", FIELDS, _ListSink(), is_delta=False, complete=lambda: complete)
+    sink.write_rows(rows)
+    sink.close()
+
+
+def test_full_load_with_failed_pages_keeps_snapshot_and_watermark(tmp_path):
+    state = IncrementalState(str(tmp_path))
+    _load(state, _rows(range(1, 11), 1), complete=True)
+    snapshot = (tmp_path / "order_dtl.csv").read_text()
+    mark = state.watermark("order_dtl")
+
+    _load(state, _rows(range(1, 6), 2), complete=False)
+
+    assert (tmp_path / "order_dtl.csv").read_text() == snapshot
+    assert state.watermark("order_dtl") == mark
+    assert not (tmp_path / "order_dtl.csv.tmp").exists()
+
+
+def test_watermark_only_advances_when_extraction_is_complete(tmp_path):
+    state = IncrementalState(str(tmp_path), warehouse=object())
+    for day, complete in ((1, True), (2, False)):
+        sink = state.snapshot_sink("order_dtl", FIELDS, _ListSink(), is_delta=False, complete=lambda: complete)
+        sink.write_rows(_rows(range(1, 3), day))
+        sink.close()
+    assert state.watermark("order_dtl") == "2024-01-01T00:00:02+00:00"
+
+
+def test_delta_replays_null_fields_from_snapshot_as_none(tmp_path):
+    state = IncrementalState(str(tmp_path))
+    _load(state, [("1", "2024-01-01T00:00:01+00:00", None), ("2", "2024-01-01T00:00:02+00:00", "1")], complete=True)
+
+    out = _ListSink()
+    sink = state.snapshot_sink("order_dtl", FIELDS, out, is_delta=True, complete=lambda: True)
+    sink.write_rows([("2", "2024-01-02T00:00:00+00:00", "3")])
+    sink.close()
+
+    assert [tuple(row) for row in out.rows] == [
+        ("1", "2024-01-01T00:00:01+00:00", None),
+        ("2", "2024-01-02T00:00:00+00:00", "3"),
+    ]
@@ -0,0 +1,80 @@
+import duckdb
+
+from consolidation import Warehouse
+from extractors import order_dtl, order_hdr, order_status
+from metrics import RunMetrics
+from schema import EntitySchema
+from wms_client import WMSClient
+
+SCHEMA = EntitySchema(
+    "order_dtl",
+    ["id", "mod_ts", "order_id.id", "ord_qty"],
+    types={"id": "int", "order_id_id": "int", "ord_qty": "float"},
+)
+
+
+def _full_load(warehouse, ids, qty=1.0, complete=None):
+    sink = warehouse.staging_sink("order_dtl", replace=True, complete=complete)
+    sink.write_rows([(i, "2024-01-01T00:00:00", i, qty) for i in ids])
+    sink.close()
+
+
+def _raw(con):
+    return dict(con.execute("SELECT id, ord_qty FROM raw_order_dtl").fetchall())
+
+
+def test_full_load_removes_ids_missing_from_wms():
+    con = duckdb.connect()
+    warehouse = Warehouse(con, {"order_dtl": SCHEMA})
+    _full_load(warehouse, range(1, 11))
+    _full_load(warehouse, range(1, 6), complete=lambda: True)
+    assert sorted(_raw(con)) == [1, 2, 3, 4, 5]
+
+
+def test_full_load_with_failed_pages_keeps_missing_ids():
+    con = duckdb.connect()
+    warehouse = Warehouse(con, {"order_dtl": SCHEMA})
+    _full_load(warehouse, range(1, 11))
+
+    client = WMSClient("http://wms", "u", "p", metrics=RunMetrics())
+    client.metrics.entity("order_dtl").failed_pages = 1
+    _full_load(warehouse, range(1, 6), qty=2.0, complete=lambda: client.entity_complete("order_dtl"))
+
+    raw = _raw(con)
+    assert sorted(raw) == list(range(1, 11))
+    # O que chegou ainda é aplicado (upsert); só a remoção é suspensa
+    assert raw[1] == 2.0 and raw[10] == 1.0
+    # Sem atualização da base consolidada, os ids alterados continuam pendentes
+    assert con.execute("SELECT count(*) FROM chg_order_dtl").fetchone()[0] == 10
+
+
+def _load_orders(path, dtl_qty, refresh):
+    """Uma execução: carga completa das três entidades num warehouse em disco e, opcionalmente, refresh."""
+    con = duckdb.connect(str(path))
+    schemas = {"order_hdr": order_hdr.SCHEMA, "order_dtl": order_dtl.SCHEMA, "order_status": order_status.SCHEMA}
+    warehouse = Warehouse(con, schemas)
+    records = {
+        "order_hdr": [
+            {"id": order, "order_nbr": f"R{order}", "status_id": 0, "order_type_id": {"key": "10"}} for order in (1, 2)
+        ],
+        # Uma linha por pedido: a linha 10 no pedido 1, a 11 no pedido 2
+        "order_dtl": [{"id": dtl, "order_id": {"id": dtl - 9}, "ord_qty": qty} for dtl, qty in dtl_qty.items()],
+        "order_status": [{"id": 0, "description": "Criado"}],
+    }
+    for entity, schema in schemas.items():
+        sink = warehouse.staging_sink(entity, replace=True)
+        sink.write_rows(schema.rows(records[entity]))
+        sink.close()
+    rows = None
+    if refresh:
+        table = warehouse.refresh_base_status()
+        rows = con.execute(f"SELECT _dtl_id, qtd_pedido FROM {table} ORDER BY _dtl_id").fetchall()
+    con.close()
+    return rows
+
+
+def test_base_status_applies_merges_from_runs_without_refresh(tmp_path):
+    path = tmp_path / "warehouse.duckdb"
+    assert _load_orders(path, {10: 1.0, 11: 1.0}, refresh=True) == [(10, 1.0), (11, 1.0)]
+    _load_orders(path, {10: 7.0, 11: 1.0}, refresh=False)
+    assert _load_orders(path, {10: 7.0, 11: 3.0}, refresh=True) == [(10, 7.0), (11, 3.0)]
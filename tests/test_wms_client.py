@@ -0,0 +1,51 @@
+import asyncio
+from collections import Counter
+
+from aiohttp import web
+
+from wms_client import WMSClient
+
+PAGE_COUNT = 5
+PAGE_SIZE = 3
+
+
+async def _serve(handler):
+    app = web.Application()
+    app.router.add_get("/wms/lgfapi/v10/entity/{entity}", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def test_speculative_pages_beyond_page_count_are_not_failures():
+    hits = Counter()
+
+    async def handler(request):
+        page = int(request.query["page"])
+        hits[page] += 1
+        if page == 1:
+            # Página 1 lenta: as especulativas chegam antes de se saber o total
+            await asyncio.sleep(0.2)
+        if page > PAGE_COUNT:
+            raise web.HTTPNotFound()
+        results = [{"id": (page - 1) * PAGE_SIZE + i} for i in range(PAGE_SIZE)]
+        return web.json_response({"page_count": PAGE_COUNT, "results": results})
+
+    async def scenario():
+        runner, base_url = await _serve(handler)
+        try:
+            client = WMSClient(base_url, "u", "p", retries=3, backoff_base=0.01, speculative_pages=8)
+            rows = await client.fetch_all("order_dtl")
+        finally:
+            await runner.cleanup()
+        return client, rows
+
+    client, rows = asyncio.run(scenario())
+    assert sorted(row["id"] for row in rows) == list(range(PAGE_COUNT * PAGE_SIZE))
+    assert client.metrics.entity("order_dtl").failed_pages == 0
+    assert client.entity_complete("order_dtl")
+    # 404 não é retentado
+    assert all(hits[page] == 1 for page in range(PAGE_COUNT + 1, 9))
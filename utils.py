@@ -1,7 +1,21 @@
 import csv
+import gzip
 import io
 import json
-from typing import Any, Dict, Iterable, List, Sequence
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Union
+
+try:
+    import zstandard
+except Exception:
+    zstandard = None
+
+
+# Mesma saída de json.dumps(value, ensure_ascii=False), sem criar um encoder a cada célula
+_encode_json = json.JSONEncoder(ensure_ascii=False).encode
 
 
 def to_scalar(value: Any) -> Any:
@@ -9,7 +23,7 @@ def to_scalar(value: Any) -> Any:
         return ""
     if isinstance(value, (str, int, float, bool)):
         return value
-    return json.dumps(value, ensure_ascii=False)
+    return _encode_json(value)
 
 
 def flatten_one_level(record: Dict[str, Any]) -> Dict[str, Any]:
@@ -47,3 +61,229 @@ def csv_bytes_from_dicts_fixed(records: Iterable[Dict[str, Any]], fieldnames: Se
     for rec in records:
         writer.writerow(rec)
     return buffer.getvalue().encode("utf-8")
+
+
+class FixedCsvSink:
+    """Escreve CSV de colunas fixas em um arquivo binário, página a página.
+
+    As linhas são sequências na ordem de `fieldnames` (ex.: tuplas de EntitySchema.row).
+    """
+
+    def __init__(self, fileobj: BinaryIO, fieldnames: Sequence[str]) -> None:
+        self.fileobj = fileobj
+        self.fieldnames = list(fieldnames)
+        self.rows_written = 0
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+        self._writer.writerow(self.fieldnames)
+        self._flush()
+
+    def _flush(self) -> None:
+        self.fileobj.write(self._buffer.getvalue().encode("utf-8"))
+        self._buffer.seek(0)
+        self._buffer.truncate(0)
+
+    def write_rows(self, rows: Iterable[Sequence[Any]]) -> None:
+        writerow = self._writer.writerow
+        for row in rows:
+            writerow(row)
+            self.rows_written += 1
+        self._flush()
+
+    def close(self) -> None:
+        self.fileobj.flush()
+
+
+# Cache padrão dos extratores de schema dinâmico (container, inventory, container_status)
+DEFAULT_SCHEMA_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "state", "dynamic_schemas.json")
+
+
+class SchemaCache:
+    """Colunas já vistas por entidade nos extratores de schema dinâmico, persistidas em JSON.
+
+    Com o cabeçalho conhecido de antemão, o DynamicCsvSink grava as linhas à medida que as páginas
+    chegam e a ordem das colunas fica estável entre execuções; chaves novas entram no fim.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self._columns: Dict[str, List[str]] = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._columns = json.load(f)
+
+    def columns(self, entity: str) -> List[str]:
+        return list(self._columns.get(entity, []))
+
+    def update(self, entity: str, columns: Sequence[str]) -> None:
+        if self._columns.get(entity) == list(columns):
+            return
+        self._columns[entity] = list(columns)
+        if self.path:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._columns, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+
+class DynamicCsvSink:
+    """CSV de colunas dinâmicas gravado página a página, sem guardar os registros em memória.
+
+    Recebe registros já achatados (flatten_one_level). As colunas começam pelas do SchemaCache;
+    uma chave nova amplia o schema (a coluna entra no fim). As linhas vão para um spool (memória
+    até 32 MB, depois disco) e, no close(), o cabeçalho final e o spool são copiados para `fileobj`.
+    Só quando o schema é ampliado no meio da execução o spool é regravado com as linhas anteriores
+    completadas com células vazias; com o cache em dia, isso não acontece.
+    """
+
+    def __init__(
+        self,
+        fileobj: BinaryIO,
+        entity: str,
+        schema_cache: Optional[SchemaCache] = None,
+        spool_max_bytes: int = 32 * 1024 * 1024,
+    ) -> None:
+        self.fileobj = fileobj
+        self.entity = entity
+        self.schema_cache = schema_cache or SchemaCache()
+        self.columns: List[str] = self.schema_cache.columns(entity)
+        self._index: Dict[str, int] = {col: i for i, col in enumerate(self.columns)}
+        self.rows_written = 0
+        self._spool_max_bytes = spool_max_bytes
+        self._spool = tempfile.SpooledTemporaryFile(max_size=spool_max_bytes)
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+
+    def write_records(self, records: Iterable[Dict[str, Any]]) -> None:
+        index = self._index
+        width = len(self.columns)
+        rows: List[List[Any]] = []
+        for rec in records:
+            row = [""] * len(index)
+            for key, value in rec.items():
+                i = index.get(key)
+                if i is None:
+                    i = index[key] = len(self.columns)
+                    self.columns.append(key)
+                    row.append("")
+                row[i] = value
+            rows.append(row)
+        if len(self.columns) > width and self.rows_written:
+            self._widen(width)
+        # Linhas anteriores à chave nova (na mesma página) ficam mais curtas: completa no fim
+        total = len(self.columns)
+        writerow = self._writer.writerow
+        for row in rows:
+            if len(row) < total:
+                row.extend([""] * (total - len(row)))
+            writerow(row)
+        self.rows_written += len(rows)
+        self._spool.write(self._buffer.getvalue().encode("utf-8"))
+        self._buffer.seek(0)
+        self._buffer.truncate(0)
+
+    def _widen(self, old_width: int) -> None:
+        """Regrava o spool completando as linhas já escritas com as colunas novas."""
+        padding = [""] * (len(self.columns) - old_width)
+        widened = tempfile.SpooledTemporaryFile(max_size=self._spool_max_bytes)
+        self._spool.seek(0)
+        reader = io.TextIOWrapper(self._spool, encoding="utf-8", newline="")
+        writer = io.TextIOWrapper(widened, encoding="utf-8", newline="")
+        csv_writer = csv.writer(writer)
+        for row in csv.reader(reader):
+            csv_writer.writerow(row + padding)
+        writer.flush()
+        writer.detach()
+        reader.detach()
+        self._spool.close()
+        self._spool = widened
+
+    def close(self) -> None:
+        header = io.StringIO()
+        csv.writer(header).writerow(self.columns)
+        self.fileobj.write(header.getvalue().encode("utf-8"))
+        self._spool.seek(0)
+        shutil.copyfileobj(self._spool, self.fileobj)
+        self._spool.close()
+        self.fileobj.flush()
+        self.schema_cache.update(self.entity, self.columns)
+
+
+# Compressões de CSV aceitas em `outputs` -> sufixo do arquivo e mime
+_CSV_COMPRESSIONS = {
+    "gzip": (".gz", "application/gzip"),
+    "zstd": (".zst", "application/zstd"),
+}
+_PARQUET_CODECS = ("zstd", "snappy", "gzip", "lz4", "brotli", "uncompressed")
+PARQUET_MIME = "application/vnd.apache.parquet"
+
+
+class OutputSpec(NamedTuple):
+    file_name: str  # nome final no Drive, já com .gz/.zst quando comprimido
+    format: str  # "csv" ou "parquet"
+    compression: Optional[str]  # CSV: None, "gzip" ou "zstd"; Parquet: codec
+    mime_type: str
+
+
+def output_spec(value: Union[str, Dict[str, Any], None], default: str) -> OutputSpec:
+    """Interpreta uma entrada de `outputs`: nome do arquivo ou {"file", "compression"}.
+
+    A extensão define o formato: ".parquet" (zstd por padrão), ".csv.gz"/".csv.zst" ou CSV puro.
+    Com "compression" num CSV, o sufixo correspondente é acrescentado ao nome; um "compression"
+    diferente do sufixo já presente (ex.: "x.csv.gz" com zstd) é erro.
+    """
+    explicit = None
+    if isinstance(value, dict):
+        file_name = value.get("file") or default
+        explicit = value.get("compression") or None
+    else:
+        file_name = value or default
+    compression = None if explicit == "none" else explicit
+    lower = file_name.lower()
+
+    if lower.endswith(".parquet"):
+        codec = compression or "zstd"
+        if codec not in _PARQUET_CODECS:
+            raise ValueError(f"Compressão Parquet inválida em {file_name}: {codec}")
+        return OutputSpec(file_name, "parquet", codec, PARQUET_MIME)
+
+    for name, (suffix, mime_type) in _CSV_COMPRESSIONS.items():
+        if lower.endswith(suffix):
+            if explicit is not None and compression != name:
+                raise ValueError(f"Compressão {explicit} conflita com a extensão de {file_name} ({name})")
+            compression = name
+    if compression is None:
+        return OutputSpec(file_name, "csv", None, "text/csv")
+    if compression not in _CSV_COMPRESSIONS:
+        raise ValueError(f"Compressão CSV inválida em {file_name}: {compression} (use gzip ou zstd)")
+    suffix, mime_type = _CSV_COMPRESSIONS[compression]
+    if not lower.endswith(suffix):
+        file_name += suffix
+    return OutputSpec(file_name, "csv", compression, mime_type)
+
+
+def require_compressor(compression: Optional[str]) -> None:
+    """Falha já na leitura da configuração se a compressão depende de biblioteca não instalada."""
+    if compression == "zstd" and zstandard is None:
+        raise ImportError("zstandard é necessário para CSV .zst. Instale com: pip install zstandard")
+
+
+@contextmanager
+def compressed_writer(fileobj: BinaryIO, compression: Optional[str]) -> Iterator[BinaryIO]:
+    """Escreve em `fileobj` comprimindo em streaming (gzip/zstd); sem compressão, escreve direto.
+
+    Ao sair, o compressor é finalizado mas `fileobj` continua aberto.
+    """
+    if compression is None:
+        yield fileobj
+    elif compression == "gzip":
+        # mtime fixo: mesmo conteúdo gera os mesmos bytes (e o mesmo md5 no Drive)
+        with gzip.GzipFile(fileobj=fileobj, mode="wb", mtime=0) as writer:
+            yield writer
+    elif compression == "zstd":
+        require_compressor(compression)
+        with zstandard.ZstdCompressor().stream_writer(fileobj, closefd=False) as writer:
+            yield writer
+    else:
+        raise ValueError(f"Compressão inválida: {compression}")
@@ -1,10 +1,18 @@
 import asyncio
-import json
+import contextlib
 import logging
-from typing import Any, Dict, List, Tuple
+import random
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Set, Tuple
 
 import aiohttp
 
+from checkpoint import RunCheckpoint
+from json_codec import resolve_decoder
+from metrics import RunMetrics
+from rate_limiter import AdaptiveLimiter, parse_retry_after
+
 
 class WMSClient:
     def __init__(
@@ -17,6 +25,18 @@ class WMSClient:
         timeout_seconds: float = 30.0,
         retries: int = 3,
         backoff_base: float = 0.5,
+        entity_weights: Optional[Dict[str, float]] = None,
+        adaptive: bool = False,
+        min_concurrency: int = 1,
+        max_concurrency: Optional[int] = None,
+        speculative_pages: int = 0,
+        page_size: Optional[int] = None,
+        project_fields: bool = True,
+        decoder: str = "auto",
+        decode_executor: str = "thread",
+        decode_offload_bytes: int = 256 * 1024,
+        checkpoint: Optional[RunCheckpoint] = None,
+        metrics: Optional[RunMetrics] = None,
     ) -> None:
         self.base_url = base_url.rstrip("/")
         self.username = username
@@ -26,44 +46,179 @@ class WMSClient:
         self.timeout_seconds = timeout_seconds
         self.retries = retries
         self.backoff_base = backoff_base
+        self.entity_weights = dict(entity_weights or {})
+        self.adaptive = adaptive
+        self.min_concurrency = min_concurrency if adaptive else concurrency
+        self.max_concurrency = (max_concurrency or concurrency * 4) if adaptive else concurrency
+        self.speculative_pages = speculative_pages
+        self.page_size = page_size
+        self.project_fields = project_fields
+        self.decoder_name, self._decode = resolve_decoder(decoder)
+        self.decode_executor = decode_executor
+        self.decode_offload_bytes = decode_offload_bytes
+        # Spool das páginas concluídas (opcional), para retomar a execução com --resume
+        self.checkpoint = checkpoint
+        # Páginas, latência, retentativas, bytes e decodificação por entidade (relatório da execução)
+        self.metrics = metrics if metrics is not None else RunMetrics()
 
-        # Client session resources are created in async context within fetch_all
+        # Sessão e limite global de requisições em voo são criados em open() (ou por
+        # chamada de iter_pages, quando o cliente não foi aberto explicitamente)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._limiter: Optional[AdaptiveLimiter] = None
+        self._process_pool: Optional[Executor] = None
+        self._open_count = 0
 
-    async def _fetch_total_pages(self, session: aiohttp.ClientSession, entity: str) -> int:
-        url = f"{self.base_url}/wms/lgfapi/v10/entity/{entity}"
-        async with session.get(url, params={"page": 1}, ssl=self.verify_ssl) as response:
-            response.raise_for_status()
-            data = await response.json()
-            return int(data.get("page_count", 1))
+    async def open(self) -> None:
+        # Contagem de referências: chamadas aninhadas/concorrentes compartilham a mesma sessão
+        self._open_count += 1
+        if self._session is not None:
+            return
+        timeout = aiohttp.ClientTimeout(total=self.timeout_seconds)
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        self._session = aiohttp.ClientSession(
+            auth=aiohttp.BasicAuth(self.username, self.password),
+            timeout=timeout,
+            connector=connector,
+        )
+        self._limiter = AdaptiveLimiter(
+            initial=self.concurrency,
+            min_limit=self.min_concurrency,
+            max_limit=self.max_concurrency,
+        )
+        if self.decode_executor == "process":
+            self._process_pool = ProcessPoolExecutor()
+
+    async def close(self) -> None:
+        self._open_count = max(0, self._open_count - 1)
+        if self._open_count > 0 or self._session is None:
+            return
+        session, self._session = self._session, None
+        if self._limiter is not None and self._limiter.adaptive:
+            logging.info("Concorrência WMS ao final da sessão: %s", int(self._limiter.limit))
+        self._limiter = None
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+        await session.close()
+
+    async def __aenter__(self) -> "WMSClient":
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
+
+    @contextlib.asynccontextmanager
+    async def _session_scope(self) -> AsyncIterator[aiohttp.ClientSession]:
+        # Reaproveita a sessão compartilhada; sem ela, abre uma só para esta chamada
+        async with self:
+            yield self._session
+
+    def entity_complete(self, entity: str) -> bool:
+        """False se alguma página de `entity` falhou nesta execução ou ficou faltando no checkpoint."""
+        if self.metrics.entity(entity).failed_pages:
+            return False
+        return self.checkpoint is None or self.checkpoint.entity_complete(entity)
+
+    def _entity_limit(self, entity: str) -> int:
+        """Quantas páginas de `entity` podem ficar em voo, conforme o peso configurado."""
+        weight = self.entity_weights.get(entity)
+        total = sum(self.entity_weights.values())
+        if not weight or total <= 0:
+            return self.max_concurrency
+        return max(1, round(self.max_concurrency * weight / total))
+
+    async def _decode_body(self, entity: str, body: bytes) -> Any:
+        """Decodifica o JSON da página; corpos grandes saem do loop de eventos (thread ou processo)."""
+        started = time.perf_counter()
+        if len(body) < self.decode_offload_bytes or self.decode_executor == "none":
+            data = self._decode(body)
+        elif self._process_pool is not None:
+            data = await asyncio.get_running_loop().run_in_executor(self._process_pool, self._decode, body)
+        else:
+            data = await asyncio.to_thread(self._decode, body)
+        elapsed = time.perf_counter() - started
+
+        self.metrics.entity(entity).observe_decode(len(body), elapsed)
+        logging.debug("Decodificação %s: %s bytes em %.4fs (%s)", entity, len(body), elapsed, self.decoder_name)
+        return data
+
+    def _log_decode_stats(self, entity: str) -> None:
+        stats = self.metrics.entities.get(entity)
+        if not stats or not stats.decoded_pages:
+            return
+        logging.info(
+            "Decodificação JSON %s (%s): %s páginas, %.1f MB, %.2fs no total, %.4fs/página (máx %.4fs)",
+            entity,
+            self.decoder_name,
+            stats.decoded_pages,
+            stats.bytes / (1024 * 1024),
+            stats.decode_seconds,
+            stats.decode_seconds / stats.decoded_pages,
+            stats.decode_max_seconds,
+        )
 
     async def _fetch_page(
         self,
         session: aiohttp.ClientSession,
         entity: str,
         page: int,
-    ) -> Tuple[int, List[Dict[str, Any]]]:
+        params: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[int, Optional[Dict[str, Any]]]:
+        """Busca uma página com retry; devolve o JSON completo (com page_count) ou None se falhar.
+
+        Só 429, 5xx e erros de rede são retentados: os demais 4xx (como o 404 de uma página
+        especulativa além do total) voltam None na hora. A falha é contada por iter_pages, que
+        sabe se a página estava dentro de `page_count`.
+        """
         url = f"{self.base_url}/wms/lgfapi/v10/entity/{entity}"
+        stats = self.metrics.entity(entity)
         attempt = 0
         while True:
             attempt += 1
+            stats.requests += 1
+            if attempt > 1:
+                stats.retries += 1
+            retry_after: Optional[float] = None
             try:
-                async with session.get(url, params={"page": page}, ssl=self.verify_ssl) as response:
-                    if response.status >= 500:
-                        raise aiohttp.ClientResponseError(
-                            request_info=response.request_info,
-                            history=response.history,
-                            status=response.status,
-                            message=f"Server error {response.status}",
-                        )
-                    response.raise_for_status()
-                    data = await response.json()
-                    results = data.get("results", [])
-                    return page, results
+                async with self._limiter.slot():
+                    started = time.monotonic()
+                    async with session.get(url, params={**(params or {}), "page": page}, ssl=self.verify_ssl) as response:
+                        if response.status == 429 or response.status >= 500:
+                            stats.latency.observe(time.monotonic() - started)
+                            if response.status == 429:
+                                stats.throttled += 1
+                            else:
+                                stats.server_errors += 1
+                            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                            self._limiter.on_overload(retry_after, reason=f"HTTP {response.status}")
+                            raise aiohttp.ClientResponseError(
+                                request_info=response.request_info,
+                                history=response.history,
+                                status=response.status,
+                                message=f"Server error {response.status}",
+                            )
+                        response.raise_for_status()
+                        body = await response.read()
+                        latency = time.monotonic() - started
+                        self._limiter.on_success(latency)
+                        stats.latency.observe(latency)
+                # Decodifica fora do slot do limitador: a rede segue enquanto o JSON é processado
+                return page, await self._decode_body(entity, body)
             except (aiohttp.ClientConnectorError, aiohttp.ClientResponseError, asyncio.TimeoutError) as e:
+                if isinstance(e, (aiohttp.ClientConnectorError, asyncio.TimeoutError)):
+                    self._limiter.on_overload(reason=type(e).__name__)
+                    stats.network_errors += 1
+                elif e.status < 500 and e.status != 429:
+                    logging.warning("Página %s de %s: HTTP %s, sem nova tentativa", page, entity, e.status)
+                    return page, None
                 if attempt > self.retries:
                     logging.error("Falha página %s após %s tentativas (%s): %s", page, self.retries, entity, e)
-                    return page, []
-                sleep_s = self.backoff_base * (2 ** (attempt - 1))
+                    return page, None
+                # Backoff exponencial com jitter completo; Retry-After do servidor é o piso
+                sleep_s = random.uniform(0, self.backoff_base * (2 ** (attempt - 1)))
+                if retry_after is not None:
+                    sleep_s = max(sleep_s, retry_after)
                 logging.warning(
                     "Erro ao buscar %s página %s (tentativa %s/%s): %s. Retentando em %.1fs",
                     entity,
@@ -75,30 +230,159 @@ class WMSClient:
                 )
                 await asyncio.sleep(sleep_s)
 
-    async def fetch_all(self, entity: str, limit_pages: int | None = None) -> List[Dict[str, Any]]:
-        items: List[Dict[str, Any]] = []
-        timeout = aiohttp.ClientTimeout(total=self.timeout_seconds)
-        connector = aiohttp.TCPConnector(limit=self.concurrency)
-        async with aiohttp.ClientSession(
-            auth=aiohttp.BasicAuth(self.username, self.password),
-            timeout=timeout,
-            connector=connector,
-        ) as session:
-            total_pages = await self._fetch_total_pages(session, entity)
-            if limit_pages is not None:
+    async def iter_pages(
+        self,
+        entity: str,
+        limit_pages: int | None = None,
+        params: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+        page_size: Optional[int] = None,
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Entrega os resultados página a página, na ordem em que chegam.
+
+        No máximo `concurrency` páginas ficam em voo ao mesmo tempo (ou a fatia de
+        `entity_weights` da entidade), então a memória fica limitada a
+        concurrency x tamanho de página, e não ao tamanho da tabela.
+
+        A página 1 já é dado: o `page_count` vem dela, sem requisição extra de sondagem.
+        Com `speculative_pages` > 1, as páginas 2..N saem junto com a 1, antes de se saber
+        o total; as que passarem de `page_count` são canceladas ou descartadas.
+
+        `fields` e `page_size` viram os parâmetros `fields`/`page_size` da LgfAPI, para que
+        só os campos usados atravessem a rede.
+
+        Com `checkpoint`, cada página concluída é gravada no spool da execução; ao retomar,
+        as páginas já gravadas são relidas do disco e só as que faltam vão à API.
+        """
+        limit = self._entity_limit(entity)
+        params = dict(params or {})
+        if fields and self.project_fields:
+            params["fields"] = ",".join(fields)
+        page_size = page_size or self.page_size
+        if page_size:
+            params["page_size"] = int(page_size)
+        checkpoint = self.checkpoint
+        stats = self.metrics.entity(entity)
+        stored: Set[int] = set()
+        total_pages: Optional[int] = None
+        if checkpoint is not None:
+            total_pages, stored = checkpoint.begin(entity, params)
+            if total_pages is not None and limit_pages is not None:
                 total_pages = min(total_pages, limit_pages)
+            for page in sorted(stored):
+                if total_pages is None or page <= total_pages:
+                    page_items = await asyncio.to_thread(checkpoint.load_page, entity, page)
+                    stats.resumed_pages += 1
+                    stats.rows += len(page_items)
+                    if page_items:
+                        yield page_items
+
+        async with self._session_scope() as session:
+            pending: Dict[asyncio.Task, int] = {}
+            early: Dict[int, Optional[Dict[str, Any]]] = {}
+
+            def launch(page: int) -> None:
+                task = asyncio.create_task(self._fetch_page(session=session, entity=entity, page=page, params=params))
+                pending[task] = page
+
+            async def accept(page: int, data: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+                # Só páginas dentro do total chegam aqui: o excesso especulativo não é dado nem falha
+                if data is None:
+                    stats.failed_pages += 1
+                    return []
+                page_items = data.get("results", [])
+                stats.pages += 1
+                stats.rows += len(page_items)
+                if checkpoint is not None:
+                    await asyncio.to_thread(checkpoint.save_page, entity, page, page_items)
+                return page_items
 
-            tasks = [
-                asyncio.create_task(self._fetch_page(session=session, entity=entity, page=page))
-                for page in range(1, total_pages + 1)
-            ]
-
-            for coro in asyncio.as_completed(tasks):
-                try:
-                    _page, page_items = await coro
-                except Exception as e:
-                    logging.error("Exceção em tarefa de página %s: %s", entity, e)
-                    page_items = []
-                if page_items:
-                    items.extend(page_items)
+            next_page = 1
+            if total_pages is None:
+                speculative = max(1, self.speculative_pages)
+                if limit_pages is not None:
+                    speculative = min(speculative, limit_pages)
+                launch(1)
+                next_page = 2
+                while next_page <= speculative and len(pending) < limit:
+                    launch(next_page)
+                    next_page += 1
+
+            try:
+                while pending or (total_pages is not None and next_page <= total_pages):
+                    if total_pages is not None:
+                        while next_page <= total_pages and len(pending) < limit:
+                            if next_page not in stored:
+                                launch(next_page)
+                            next_page += 1
+                        if not pending:
+                            continue
+
+                    done, _ = await asyncio.wait(pending.keys(), return_when=asyncio.FIRST_COMPLETED)
+                    for task in sorted(done, key=lambda t: pending.get(t, 0)):
+                        page = pending.pop(task, None)
+                        if page is None:
+                            # Excesso especulativo já descartado pela página 1 desta mesma rodada
+                            continue
+                        try:
+                            _page, data = task.result()
+                        except Exception as e:
+                            logging.error("Exceção em tarefa de página %s: %s", entity, e)
+                            data = None
+
+                        if page == 1 and total_pages is None:
+                            if data is None:
+                                stats.failed_pages += 1
+                                raise RuntimeError(f"Não foi possível obter a página 1 de {entity}")
+                            total_pages = int(data.get("page_count", 1))
+                            if checkpoint is not None:
+                                checkpoint.set_page_count(entity, total_pages)
+                            if limit_pages is not None:
+                                total_pages = min(total_pages, limit_pages)
+                            page_items = await accept(page, data)
+                            # Cancela o excesso especulativo e libera o que chegou antes do total
+                            for other, other_page in list(pending.items()):
+                                if other_page > total_pages:
+                                    other.cancel()
+                                    pending.pop(other)
+                            for early_page in sorted(early):
+                                if early_page <= total_pages:
+                                    early_items = await accept(early_page, early[early_page])
+                                    if early_items:
+                                        yield early_items
+                            early.clear()
+                        elif total_pages is None:
+                            early[page] = data
+                            continue
+                        elif page > total_pages:
+                            continue
+                        else:
+                            page_items = await accept(page, data)
+
+                        if page_items:
+                            yield page_items
+                if checkpoint is not None:
+                    checkpoint.finish(entity)
+            finally:
+                for task in pending:
+                    task.cancel()
+                self._log_decode_stats(entity)
+
+    async def fetch_all(
+        self,
+        entity: str,
+        limit_pages: int | None = None,
+        params: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+        page_size: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        items: List[Dict[str, Any]] = []
+        async for page_items in self.iter_pages(
+            entity,
+            limit_pages=limit_pages,
+            params=params,
+            fields=fields,
+            page_size=page_size,
+        ):
+            items.extend(page_items)
         return items